@@ -79,6 +79,15 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "appointments_api.wsgi.application"
 
+# Hours of the day the availability search offers when the request does not pick them,
+# the start hour is included and the end hour is not
+AVAILABILITY_START_HOUR = config('AVAILABILITY_START_HOUR', default=9, cast=int)
+AVAILABILITY_END_HOUR = config('AVAILABILITY_END_HOUR', default=17, cast=int)
+
+# Routes the dashboard, today and calendar endpoints to async views,
+# only worth enabling when served by an ASGI server through appointments_api.asgi
+ASYNC_READ_VIEWS = config('ASYNC_READ_VIEWS', default=False, cast=bool)
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -94,6 +103,21 @@ DATABASES = {
     }
 }
 
+# Cache
+# The data, directory and token versions are read from the cache, so every worker
+# has to share it: Redis on CACHE_LOCATION by default, local memory while DEBUG is on.
+# CACHE_BACKEND picks another backend, appointments_api.test_settings is used for tests
+
+CACHES = {
+    "default": {
+        "BACKEND": config(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache' if DEBUG else 'django.core.cache.backends.redis.RedisCache'
+        ),
+        "LOCATION": config('CACHE_LOCATION', default='appointments' if DEBUG else 'redis://localhost:6379'),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -164,6 +188,8 @@ EMAIL_USE_TLS = config('EMAIL_USE_TLS')
 EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL= config('DEFAULT_FROM_EMAIL')
+# Welcome and password reset emails are queued in user_service.OutboxEmail,
+# the send_outbox_emails command delivers them through EMAIL_BACKEND
 
 AUTH_USER_MODEL = "user_service.User"
 
@@ -171,7 +197,7 @@ REST_FRAMEWORK = {
     "COERCE_DECIMAL_TO_STRING" : False,
     "DEFAULT_FILTER_BACKENDS": ["django_filters.rest_framework.DjangoFilterBackend"],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'user_service.authentication.CachedJWTAuthentication',
     ),
 }
 
@@ -196,6 +222,9 @@ DJOSER = {
         'user': 'user_service.serializers.CustomUserSerializer',
         'current_user': 'user_service.serializers.CustomUserSerializer'
     },
+    'EMAIL': {
+        'password_reset': 'user_service.emails.PasswordResetEmail'
+    },
     'PERMISSIONS': {
         'user_update': ['rest_framework.permissions.IsAdminUser'],
         'user_delete': ['rest_framework.permissions.IsAdminUser'],
@@ -0,0 +1,14 @@
+"""
+Settings for running the tests, python manage.py test --settings=appointments_api.test_settings
+"""
+from .settings import *
+
+CACHES = {
+    "default": {
+        "BACKEND": 'django.core.cache.backends.locmem.LocMemCache',
+        "LOCATION": 'appointments-tests',
+    }
+}
+
+# Tests run with DEBUG off on a single process, local memory is shared by all of it
+SILENCED_SYSTEM_CHECKS = ['appointments_service.W001']
@@ -0,0 +1,30 @@
+from django.utils.functional import cached_property
+from .models import Appointment
+
+class AppointmentAccess:
+    '''
+        Resolves the appointment of a nested notes request and whether the
+        user may access it, with at most one query per request
+    '''
+    def __init__(self, user, appointment_pk):
+        self.user = user
+        self.appointment_pk = appointment_pk
+
+    @cached_property
+    def appointment(self):
+        return Appointment.objects.only('id', 'created_for_id')\
+                .filter(id = self.appointment_pk)\
+                .first()
+
+    @cached_property
+    def is_allowed(self):
+        if self.user.is_staff:
+            return True
+        return self.appointment is not None and self.appointment.created_for_id == self.user.id
+
+def get_appointment_access(request, view):
+    access = getattr(request, 'appointment_access', None)
+    if access is None:
+        access = AppointmentAccess(request.user, view.kwargs.get('appointment_pk'))
+        request.appointment_access = access
+    return access
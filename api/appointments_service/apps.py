@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AppointmentsServiceConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "appointments_service"
+    
+    def ready(self):
+        import appointments_service.checks
+        import appointments_service.signals.handlers
@@ -0,0 +1,150 @@
+import datetime
+import functools
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponseNotModified, JsonResponse
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, PermissionDenied, ValidationError
+from rest_framework.request import Request
+from rest_framework.status import HTTP_401_UNAUTHORIZED, HTTP_405_METHOD_NOT_ALLOWED
+from user_service.authentication import CachedJWTAuthentication
+from user_service.conditional import is_not_modified, set_etag
+from user_service.directory import aget_directory_version
+
+from .daily_cache import aget_or_build_daily
+from .filters import CalendarFilter
+from .models import Appointment
+from .pagination import KeysetPagination
+from .serializers import CalendarSerializer, DailyAppointmentSerailizer
+from .stats import aget_user_stats
+from .versions import aget_data_version, aget_user_data_version, get_request_etag
+from .views import CalendarView, get_dashboard_data
+
+'''
+    Async versions of the hot read endpoints, routed instead of the DRF
+    views when ASYNC_READ_VIEWS is set and the app is served over ASGI.
+    They answer with the same data, status codes and ETags.
+    Cache and database reads await the async APIs, so a request waiting
+    on them does not hold a worker thread.
+'''
+
+def async_api_view(view):
+    '''
+        Gives an async view the parts of the DRF request cycle the read
+        endpoints use: GET only, JWT authentication, query_params and
+        APIException responses
+    '''
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return JsonResponse(
+                {'detail': f'Method "{request.method}" not allowed.'},
+                status = HTTP_405_METHOD_NOT_ALLOWED
+            )
+        authentication = CachedJWTAuthentication()
+        try:
+            result = await authentication.aauthenticate(request)
+            #no authenticators, the user is set here so DRF never authenticates in sync code
+            drf_request = Request(request, authenticators = ())
+            drf_request.user = result[0] if result else AnonymousUser()
+            return await view(drf_request, *args, **kwargs)
+        except APIException as exc:
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            response = JsonResponse(data, status = exc.status_code, safe = False)
+            if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+                response['WWW-Authenticate'] = authentication.authenticate_header(request)
+            return response
+    return wrapper
+
+def invalid_user_response():
+    return JsonResponse({'user': ['Invalid user.']}, status = HTTP_401_UNAUTHORIZED)
+
+def not_modified(etag):
+    return set_etag(HttpResponseNotModified(), etag)
+
+'''
+    Async version of views.dashboard
+'''
+@async_api_view
+async def dashboard(request):
+    user = request.user
+    if not user.is_authenticated:
+        return invalid_user_response()
+    now = datetime.datetime.now()
+    today = now.date()
+    version = await aget_data_version(user.id)
+    etag = get_request_etag(request, version, now.strftime('%Y-%m-%dT%H:%M'))
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    async def build():
+        stats = await aget_user_stats(user, today)
+        open_times = []
+        if stats['t_total'] > stats['t_closed']:
+            open_times = [time async for time in Appointment.objects.filter(
+                            created_for = user,
+                            date = today,
+                            is_closed = False
+                        ).values_list('time', flat = True)]
+        return stats, open_times
+
+    stats, open_times = await aget_or_build_daily('dashboard', user.id, now, version, build)
+    return set_etag(JsonResponse(get_dashboard_data(stats, open_times, now.time())), etag)
+
+'''
+    Async version of views.get_todays_appointments
+'''
+@async_api_view
+async def get_todays_appointments(request):
+    user = request.user
+    if not user.is_authenticated:
+        return invalid_user_response()
+    now = datetime.datetime.now()
+    today = now.date()
+    version = await aget_data_version(user.id)
+    etag = get_request_etag(request, version, today)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    async def build():
+        appointments = [appointment async for appointment in Appointment.objects.filter(
+                            created_for = user,
+                            date = today
+                        ).order_by('time')]
+        return DailyAppointmentSerailizer(appointments, many = True).data
+
+    data = await aget_or_build_daily('today', user.id, now, version, build)
+    return set_etag(JsonResponse(data, safe = False), etag)
+
+sync_calendar_view = sync_to_async(CalendarView.as_view())
+
+'''
+    Async version of CalendarView.
+    Streamed responses and ?fields= are left to the sync view.
+'''
+@async_api_view
+async def calendar(request):
+    if 'stream' in request.query_params or 'fields' in request.query_params:
+        return await sync_calendar_view(request._request)
+    user = request.user
+    if not user.is_authenticated:
+        raise NotAuthenticated()
+    if not user.is_staff:
+        raise PermissionDenied()
+    etag = get_request_etag(request, await aget_user_data_version(user), await aget_directory_version())
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    filterset = CalendarFilter(request.query_params, queryset = CalendarView.queryset.all(), request = request)
+    if not filterset.is_valid():
+        raise ValidationError(filterset.errors)
+    queryset = filterset.qs
+
+    paginator = KeysetPagination()
+    page = await paginator.apaginate_queryset(queryset, request)
+    if page is None:
+        page = [appointment async for appointment in queryset]
+    #avatar urls may be read from the cache or signed by the storage
+    data = await sync_to_async(lambda: CalendarSerializer(page, many = True).data)()
+    if paginator.cursor_query_param in request.query_params:
+        data = paginator.get_paginated_response(data).data
+    return set_etag(JsonResponse(data, safe = False), etag)
@@ -0,0 +1,66 @@
+import datetime
+from django.conf import settings
+from .models import Appointment
+
+def get_default_hours():
+    '''
+        Hours of the day the search offers unless the request picks them,
+        AVAILABILITY_START_HOUR up to but excluding AVAILABILITY_END_HOUR
+    '''
+    return range(settings.AVAILABILITY_START_HOUR, settings.AVAILABILITY_END_HOUR)
+
+def get_occupied_slots(user_ids, start_date, end_date):
+    '''
+        Loads every booked hour of the users in the date range with one query.
+        Returns a dict of (user_id, date) to a bitmap where bit n is set
+        when the hour n is taken.
+    '''
+    occupied = {}
+    appointments = Appointment.objects.filter(
+                    created_for__in = user_ids,
+                    date__gte = start_date,
+                    date__lte = end_date
+                ).values_list('created_for', 'date', 'time')
+    for user_id, date, time in appointments:
+        key = (user_id, date)
+        occupied[key] = occupied.get(key, 0) | (1 << time.hour)
+    return occupied
+
+def find_free_slots(user_ids, start_date, end_date, limit, hours = None, now = None):
+    '''
+        Returns up to limit (date, time, user_id) openings ordered by date,
+        hour and user, skipping slots that have already started.
+    '''
+    now = now or datetime.datetime.now()
+    hours = get_default_hours() if hours is None else hours
+    user_ids = sorted(user_ids)
+    working_mask = 0
+    for hour in hours:
+        working_mask |= 1 << hour
+    occupied = get_occupied_slots(user_ids, start_date, end_date)
+
+    openings = []
+    date = max(start_date, now.date())
+    while date <= end_date and len(openings) < limit:
+        day_mask = working_mask
+        if date == now.date():
+            #drop the hours up to and including the current one
+            day_mask &= ~((1 << (now.hour + 1)) - 1)
+        free = {
+            user_id: day_mask & ~occupied.get((user_id, date), 0)
+            for user_id in user_ids
+        }
+        available = 0
+        for user_free in free.values():
+            available |= user_free
+        while available and len(openings) < limit:
+            bit = available & -available
+            available ^= bit
+            hour = bit.bit_length() - 1
+            for user_id in user_ids:
+                if free[user_id] & bit:
+                    openings.append((date, datetime.time(hour), user_id))
+                    if len(openings) == limit:
+                        break
+        date += datetime.timedelta(days = 1)
+    return openings
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    '''
+        The data, directory and token versions are kept in the default cache,
+        a cache of its own per worker serves stale responses and ETags
+    '''
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if settings.DEBUG or backend not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [
+        Warning(
+            f'The default cache uses {backend}, which is not shared between workers.',
+            hint = 'Set CACHE_BACKEND and CACHE_LOCATION to a shared backend such as '
+                   'django.core.cache.backends.redis.RedisCache.',
+            id = 'appointments_service.W001',
+        )
+    ]
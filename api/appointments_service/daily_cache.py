@@ -0,0 +1,32 @@
+import datetime
+from django.core.cache import cache
+
+def get_seconds_until_tomorrow(now):
+    tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days = 1), datetime.time())
+    return max(int((tomorrow - now).total_seconds()), 1)
+
+def get_daily_cache_key(name, user_id, date, version):
+    return f'appointment-daily:{name}:{user_id}:{date.isoformat()}:{version}'
+
+def get_or_build_daily(name, user_id, now, version, build):
+    '''
+        Returns the value build computes for a user on the day of now.
+        Entries are keyed by the user's data version, so appointment and
+        note writes make them unreachable, and they expire at midnight.
+        The version has to be read before build runs so a concurrent
+        write can only leave newer data under an older version.
+    '''
+    key = get_daily_cache_key(name, user_id, now.date(), version)
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, get_seconds_until_tomorrow(now))
+    return value
+
+async def aget_or_build_daily(name, user_id, now, version, abuild):
+    key = get_daily_cache_key(name, user_id, now.date(), version)
+    value = await cache.aget(key)
+    if value is None:
+        value = await abuild()
+        await cache.aset(key, value, get_seconds_until_tomorrow(now))
+    return value
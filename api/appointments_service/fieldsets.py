@@ -0,0 +1,62 @@
+from rest_framework.exceptions import ValidationError
+
+class SparseFieldsetMixin:
+    '''
+        Lets list and retrieve requests pick the serialized fields with
+        ?fields=a,b and selects only the columns behind the picked fields.
+        fieldset_columns maps a serializer field to the columns and related
+        paths it reads, any other field reads the column of its own name.
+        fieldset_required_columns are always selected, e.g. pagination keys.
+        default_deferred_fields are left out of lists unless they are asked for.
+    '''
+    fields_query_param = 'fields'
+    fieldset_actions = ('list', 'retrieve')
+    fieldset_columns = {}
+    fieldset_required_columns = ('id',)
+    default_deferred_fields = ()
+
+    def get_selected_fields(self):
+        if not hasattr(self, '_selected_fields'):
+            self._selected_fields = self.parse_selected_fields()
+        return self._selected_fields
+
+    def parse_selected_fields(self):
+        #generic views without an action only list
+        action = getattr(self, 'action', 'list')
+        if self.request.method != 'GET' or action not in self.fieldset_actions:
+            return None
+        available = list(self.get_serializer_class()().fields)
+        requested = self.request.query_params.get(self.fields_query_param)
+        if requested:
+            selected = [field.strip() for field in requested.split(',') if field.strip()]
+            unknown = sorted(set(selected) - set(available))
+            if unknown:
+                raise ValidationError({self.fields_query_param: [f"Unknown fields: {', '.join(unknown)}."]})
+            return selected
+        if action == 'list' and self.default_deferred_fields:
+            return [field for field in available if field not in self.default_deferred_fields]
+        return None
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        selected = self.get_selected_fields()
+        if selected is None:
+            return queryset
+        columns = list(self.fieldset_required_columns)
+        for field in selected:
+            columns.extend(self.fieldset_columns.get(field, [field]))
+        #only join the relations the picked fields read
+        relations = {column.rsplit('__', 1)[0] for column in columns if '__' in column}
+        queryset = queryset.select_related(None)
+        if relations:
+            queryset = queryset.select_related(*relations)
+        return queryset.only(*columns)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        selected = self.get_selected_fields()
+        if selected is not None:
+            fields = getattr(serializer, 'child', serializer).fields
+            for name in set(fields) - set(selected):
+                fields.pop(name)
+        return serializer
@@ -1,25 +1,58 @@
+from django import forms
 from django_filters import rest_framework as filters
+from user_service.models import normalize_name
 from .models import Appointment
 
-class CalendarFilter(filters.FilterSet):
+class CreatedForNameFilterSet(filters.FilterSet):
+    '''
+        Filters on the full name of created_for with one lookup on the
+        normalized User.search_name, served by its trigram index
+    '''
     created_for = filters.CharFilter(method='filter_created_for')
     
+    def filter_created_for(self, queryset, name, value):
+        value = normalize_name(value)
+        if not value:
+            return queryset
+        return queryset.filter(created_for__search_name__contains=value)
+
+class CalendarFilterForm(forms.Form):
+    #widest date range the calendar can be loaded for in one request
+    max_window_days = 62
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        date_gt = cleaned_data.get('date__gt')
+        date_lt = cleaned_data.get('date__lt')
+        if date_gt and date_lt and (date_lt - date_gt).days > self.max_window_days:
+            self.add_error(
+                'date__lt',
+                f'Date range cannot be longer than {self.max_window_days} days.'
+            )
+        return cleaned_data
+
+class CalendarFilter(CreatedForNameFilterSet):
+    date__gt = filters.DateFilter(field_name='date', lookup_expr='gt', required=True)
+    date__lt = filters.DateFilter(field_name='date', lookup_expr='lt', required=True)
+    
     class Meta:
         model = Appointment
-        fields = {
-            'date': ['gt', 'lt'],
-        }
-        
-    def filter_created_for(self, queryset, name, value):
-        return queryset.filter(
-            created_for__first_name__icontains=value
-        ) | queryset.filter(
-            created_for__last_name__icontains=value
-        )
+        form = CalendarFilterForm
+        fields = [
+            'date__gt',
+            'date__lt',
+            'created_for'
+        ]
 
-class CustomAppointmentFilter(filters.FilterSet):
-    created_for = filters.CharFilter(method='filter_created_for')
+class CalendarStreamFilterForm(CalendarFilterForm):
+    #streamed rows are sent in chunks from a server side cursor, so a year fits
+    max_window_days = 366
 
+class CalendarStreamFilter(CalendarFilter):
+    class Meta(CalendarFilter.Meta):
+        form = CalendarStreamFilterForm
+
+class CustomAppointmentFilter(CreatedForNameFilterSet):
     class Meta:
         model = Appointment
         fields = {
@@ -29,10 +62,3 @@ class CustomAppointmentFilter(filters.FilterSet):
             'visit_type': ['exact'],
             'is_closed': ['exact'],
         }
-
-    def filter_created_for(self, queryset, name, value):
-        return queryset.filter(
-            created_for__first_name__icontains=value
-        ) | queryset.filter(
-            created_for__last_name__icontains=value
-        )
\ No newline at end of file
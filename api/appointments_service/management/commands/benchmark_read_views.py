@@ -0,0 +1,126 @@
+import asyncio
+import datetime
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+from appointments_service import async_views, views
+
+class Command(BaseCommand):
+    help = 'Compares the sync read views run by a pool of threads, like WSGI workers, ' \
+           'with the async read views run on one event loop, like an ASGI server. ' \
+           'Requests go straight to the views, so middleware is left out. ' \
+           'Run it against PostgreSQL and the production cache backend for meaningful numbers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'user_id',
+            type = int,
+            help = 'Id of the user the requests are authenticated as, the calendar is only read by staff.'
+        )
+        parser.add_argument(
+            '--requests',
+            type = int,
+            default = 500,
+            help = 'Number of requests per endpoint and mode.'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type = int,
+            default = 20,
+            help = 'Number of worker threads or concurrent coroutines.'
+        )
+        parser.add_argument(
+            '--calendar-days',
+            type = int,
+            default = 7,
+            help = 'Number of days the calendar requests read from today.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(id = options['user_id'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User {options['user_id']} does not exist.")
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency have to be positive.')
+
+        today = datetime.date.today()
+        endpoints = [
+            ('stats', '/appointments/stats', None, views.dashboard, async_views.dashboard),
+            ('today', '/appointments/today', None, views.get_todays_appointments, async_views.get_todays_appointments)
+        ]
+        if user.is_staff:
+            calendar_params = {
+                'date__gt': today - datetime.timedelta(days = 1),
+                'date__lt': today + datetime.timedelta(days = options['calendar_days'])
+            }
+            endpoints.append(
+                ('calendar', '/appointments/calendar', calendar_params, views.CalendarView.as_view(), async_views.calendar)
+            )
+
+        headers = {'Authorization': f'JWT {AccessToken.for_user(user)}'}
+        #both modes split the requests over the same number of workers
+        counts = [
+            options['requests'] // options['concurrency'] + (worker < options['requests'] % options['concurrency'])
+            for worker in range(min(options['concurrency'], options['requests']))
+        ]
+        for name, path, params, sync_view, async_view in endpoints:
+            for mode, results in (
+                ('wsgi', self.run_sync(sync_view, path, params, headers, counts)),
+                ('asgi', asyncio.run(self.run_async(async_view, path, params, headers, counts)))
+            ):
+                self.report(name, mode, *results)
+
+    def run_sync(self, view, path, params, headers, counts):
+        factory = RequestFactory()
+        def worker(count):
+            latencies, statuses = [], []
+            for _ in range(count):
+                start = time.perf_counter()
+                response = view(factory.get(path, params, headers = headers))
+                if hasattr(response, 'render'):
+                    response.render()
+                latencies.append(time.perf_counter() - start)
+                statuses.append(response.status_code)
+            connection.close()
+            return latencies, statuses
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(len(counts)) as pool:
+            results = list(pool.map(worker, counts))
+        return time.perf_counter() - start, results
+
+    async def run_async(self, view, path, params, headers, counts):
+        factory = AsyncRequestFactory()
+        async def worker(count):
+            latencies, statuses = [], []
+            #like the ASGI handler, the sync code of a worker's requests shares one thread
+            async with ThreadSensitiveContext():
+                for _ in range(count):
+                    start = time.perf_counter()
+                    response = await view(factory.get(path, params, headers = headers))
+                    latencies.append(time.perf_counter() - start)
+                    statuses.append(response.status_code)
+                await sync_to_async(lambda: connection.close())()
+            return latencies, statuses
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(worker(count) for count in counts))
+        return time.perf_counter() - start, results
+
+    def report(self, name, mode, elapsed, results):
+        latencies = sorted(latency for worker, _ in results for latency in worker)
+        failed = sum(1 for _, statuses in results for status in statuses if status >= 400)
+        p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+        line = f'{name:<9} {mode}  {len(latencies) / elapsed:8.1f} req/s  ' \
+               f'median {statistics.median(latencies) * 1000:7.2f} ms  p95 {p95 * 1000:7.2f} ms'
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{line}  {failed} failed'))
+        else:
+            self.stdout.write(line)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from appointments_service.stats import rebuild_appointment_stats
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalized appointment stats from the appointments table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type = int,
+            action = 'append',
+            dest = 'user_ids',
+            help = 'Only rebuild the stats of this user id, can be repeated.'
+        )
+
+    def handle(self, *args, **options):
+        rows = rebuild_appointment_stats(options['user_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} appointment stats rows.'))
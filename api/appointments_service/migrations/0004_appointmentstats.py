@@ -0,0 +1,84 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_appointment_stats(apps, schema_editor):
+    Appointment = apps.get_model("appointments_service", "Appointment")
+    AppointmentStats = apps.get_model("appointments_service", "AppointmentStats")
+    rows = []
+    lifetime = {}
+    buckets = (
+        Appointment.objects.values("created_for", "date")
+        .annotate(total=Count("id"), closed=Count("id", filter=Q(is_closed=True)))
+        .order_by()
+    )
+    for bucket in buckets.iterator():
+        rows.append(
+            AppointmentStats(
+                user_id=bucket["created_for"],
+                date=bucket["date"],
+                total=bucket["total"],
+                closed=bucket["closed"],
+            )
+        )
+        user_total = lifetime.setdefault(bucket["created_for"], [0, 0])
+        user_total[0] += bucket["total"]
+        user_total[1] += bucket["closed"]
+    rows.extend(
+        AppointmentStats(user_id=user_id, date=None, total=total, closed=closed)
+        for user_id, (total, closed) in lifetime.items()
+    )
+    AppointmentStats.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("appointments_service", "0003_appointment_description"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AppointmentStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(null=True)),
+                ("total", models.IntegerField(default=0)),
+                ("closed", models.IntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="appointment_stats",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "date"),
+                        name="unique_appointment_stats_user_date",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("date__isnull", True)),
+                        fields=("user",),
+                        name="unique_appointment_stats_user_lifetime",
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(populate_appointment_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("appointments_service", "0004_appointmentstats"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="appointment",
+            index=models.Index(
+                fields=["created_for", "date", "time"],
+                name="appointment_user_date_time_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="appointment",
+            index=models.Index(
+                fields=["date", "time"], name="appointment_date_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="appointment",
+            index=models.Index(
+                condition=models.Q(("is_closed", False)),
+                fields=["created_for", "date", "time"],
+                name="appointment_open_user_date_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:49
+
+import django.db.models.functions.datetime
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import ExtractHour
+
+
+def check_double_bookings(apps, schema_editor):
+    """
+    The constraint can not be created while a user has two appointments in
+    the same hour, which appointment to keep is left to the staff, so the
+    migration stops and lists them instead of deleting any.
+    """
+    Appointment = apps.get_model("appointments_service", "Appointment")
+    slots = (
+        Appointment.objects.annotate(hour=ExtractHour("time"))
+        .values("created_for", "date", "hour")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .order_by("created_for", "date", "hour")
+    )
+    conflicts = []
+    for slot in slots:
+        ids = (
+            Appointment.objects.annotate(hour=ExtractHour("time"))
+            .filter(created_for=slot["created_for"], date=slot["date"], hour=slot["hour"])
+            .order_by("time", "id")
+            .values_list("id", flat=True)
+        )
+        conflicts.append(
+            f"user {slot['created_for']} on {slot['date']} at {slot['hour']:02}:00: "
+            f"appointments {', '.join(str(id) for id in ids)}"
+        )
+    if conflicts:
+        raise RuntimeError(
+            "Users have more than one appointment in the same hour slot, move or "
+            "delete all but one of each before migrating again:\n" + "\n".join(conflicts)
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("appointments_service", "0005_appointment_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(check_double_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="appointment",
+            constraint=models.UniqueConstraint(
+                models.F("created_for"),
+                models.F("date"),
+                django.db.models.functions.datetime.ExtractHour("time"),
+                name="unique_appointment_user_date_hour",
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:01
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+
+
+def populate_note_summary(apps, schema_editor):
+    Appointment = apps.get_model("appointments_service", "Appointment")
+    Note = apps.get_model("appointments_service", "Note")
+    summary = (
+        Note.objects.filter(appointment=OuterRef("pk")).order_by().values("appointment")
+    )
+    Appointment.objects.filter(pk__in=Note.objects.values("appointment")).update(
+        note_count=Subquery(summary.annotate(count=Count("id")).values("count")),
+        last_note_at=Subquery(summary.annotate(last=Max("created_on")).values("last")),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("appointments_service", "0006_appointment_hour_slot_constraint"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="appointment",
+            name="last_note_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name="appointment",
+            name="note_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="note",
+            index=models.Index(
+                fields=["appointment", "created_on"],
+                name="note_appointment_created_idx",
+            ),
+        ),
+        migrations.RunPython(populate_note_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:04
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_TABLES = [
+    ("appointments_service_appointment", "appointment"),
+    ("appointments_service_note", "note"),
+]
+
+
+def create_search_triggers(apps, schema_editor):
+    # the tsvector columns are only maintained and indexed on PostgreSQL,
+    # other databases use the icontains fallback of appointments_service.search
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, name in SEARCH_TABLES:
+        schema_editor.execute(
+            f"CREATE INDEX {name}_search_vector_idx ON {table} USING gin (search_vector)"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {name}_search_vector_update "
+            f"BEFORE INSERT OR UPDATE OF description ON {table} "
+            "FOR EACH ROW EXECUTE FUNCTION "
+            "tsvector_update_trigger(search_vector, 'pg_catalog.english', description)"
+        )
+        schema_editor.execute(
+            f"UPDATE {table} SET search_vector = "
+            "to_tsvector('pg_catalog.english', coalesce(description, ''))"
+        )
+
+
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, name in SEARCH_TABLES:
+        schema_editor.execute(f"DROP TRIGGER {name}_search_vector_update ON {table}")
+        schema_editor.execute(f"DROP INDEX {name}_search_vector_idx")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("appointments_service", "0007_appointment_note_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="appointment",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(null=True),
+        ),
+        migrations.AddField(
+            model_name="note",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(null=True),
+        ),
+        migrations.RunPython(create_search_triggers, drop_search_triggers),
+    ]
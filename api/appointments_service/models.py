@@ -1,5 +1,15 @@
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import ExtractHour
+
+class SearchVectorManager(models.Manager):
+    '''
+        Leaves the search_vector column out of regular reads,
+        it is only needed inside search queries
+    '''
+    def get_queryset(self):
+        return super().get_queryset().defer('search_vector')
 
 class Appointment(models.Model):
     VISIT_TYPES = [
@@ -25,6 +35,65 @@ class Appointment(models.Model):
         max_length = 8000,
         null = True
     )
+    #kept current by the note signal handlers
+    note_count = models.IntegerField(
+        default = 0
+    )
+    last_note_at = models.DateTimeField(
+        null = True
+    )
+    #filled from description by a trigger and GIN indexed on PostgreSQL
+    search_vector = SearchVectorField(
+        null = True
+    )
+    
+    objects = SearchVectorManager()
+    
+    class Meta:
+        indexes = [
+            #per user lists, today view and slot validation
+            models.Index(
+                fields = ['created_for', 'date', 'time'],
+                name = 'appointment_user_date_time_idx'
+            ),
+            #calendar range scans ordered by date and time
+            models.Index(
+                fields = ['date', 'time'],
+                name = 'appointment_date_time_idx'
+            ),
+            #open and past due counters
+            models.Index(
+                fields = ['created_for', 'date', 'time'],
+                condition = models.Q(is_closed = False),
+                name = 'appointment_open_user_date_idx'
+            )
+        ]
+        constraints = [
+            #a user can only have one appointment per hour slot
+            models.UniqueConstraint(
+                'created_for',
+                'date',
+                ExtractHour('time'),
+                name = 'unique_appointment_user_date_hour'
+            )
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        #remember the stored stats bucket so saves can move the counters
+        instance._loaded_stats_key = instance.get_stats_key()
+        return instance
+    
+    def get_stats_key(self):
+        '''
+            Returns the (user, date, is_closed) triple the appointment
+            is counted under or None if any of them is deferred
+        '''
+        stats_fields = ('created_for_id', 'date', 'is_closed')
+        if any(field not in self.__dict__ for field in stats_fields):
+            return None
+        return tuple(self.__dict__[field] for field in stats_fields)
     
 class Note(models.Model):
     appointment = models.ForeignKey(
@@ -42,4 +111,54 @@ class Note(models.Model):
     )
     created_on = models.DateTimeField(
         auto_now_add = True
-    )
\ No newline at end of file
+    )
+    #filled from description by a trigger and GIN indexed on PostgreSQL
+    search_vector = SearchVectorField(
+        null = True
+    )
+    
+    objects = SearchVectorManager()
+    
+    class Meta:
+        indexes = [
+            models.Index(
+                fields = ['appointment', 'created_on'],
+                name = 'note_appointment_created_idx'
+            )
+        ]
+    
+class AppointmentStats(models.Model):
+    '''
+        Denormalized appointment counters for a user.
+        One row per user and appointment date, plus a lifetime row
+        per user whose date is null.
+        Kept current by the appointment signal handlers and rebuilt
+        with the rebuild_appointment_stats management command.
+    '''
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete = models.CASCADE,
+        related_name = 'appointment_stats'
+    )
+    date = models.DateField(
+        null = True
+    )
+    total = models.IntegerField(
+        default = 0
+    )
+    closed = models.IntegerField(
+        default = 0
+    )
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields = ['user', 'date'],
+                name = 'unique_appointment_stats_user_date'
+            ),
+            models.UniqueConstraint(
+                fields = ['user'],
+                condition = models.Q(date__isnull = True),
+                name = 'unique_appointment_stats_user_lifetime'
+            )
+        ]
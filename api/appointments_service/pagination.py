@@ -1,4 +1,205 @@
-from rest_framework.pagination import PageNumberPagination
+import datetime
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+class KeysetPagination(BasePagination):
+    '''
+        Opt in keyset pagination over (date, time, id).
+        It is only used when the request carries the cursor query param,
+        an empty cursor returns the first page.
+        The position is encoded in the cursor so no OFFSET or COUNT(*) is run.
+        The direction follows the first requested ordering, the keys are
+        always date, time and id so the (date, time) indexes can serve it.
+        Only date, date,time or date,time,id in one direction can be kept,
+        any other requested ordering is answered with 400.
+    '''
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    ordering = ('date', 'time', 'id')
+    invalid_cursor_message = 'Invalid cursor'
+    invalid_ordering_message = 'Cursor pagination only orders by date, date,time or date,time,id in one direction.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return None
+        return self.get_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return None
+        return self.get_page([row async for row in self.get_page_queryset(queryset, request)])
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.validate_ordering(request)
+        self.descending = self.is_descending(queryset)
+        self.position, self.reverse = self.decode_cursor(request)
+
+        #reverse pages walk backwards from the cursor and are flipped afterwards
+        descending = self.descending != self.reverse
+        queryset = queryset.order_by(*[
+            f'-{field}' if descending else field for field in self.ordering
+        ])
+        if self.position:
+            queryset = queryset.filter(self.get_position_filter(self.position, descending))
+        return queryset[:self.page_size + 1]
+
+    def get_page(self, results):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+
+        self.next_position = None
+        self.previous_position = None
+        if results:
+            if self.reverse:
+                self.next_position = self.get_position(results[-1])
+                if has_more:
+                    self.previous_position = self.get_position(results[0])
+            else:
+                if has_more:
+                    self.next_position = self.get_position(results[-1])
+                if self.position:
+                    self.previous_position = self.get_position(results[0])
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def validate_ordering(self, request):
+        fields = [
+            field.strip() for field in request.query_params.get(self.ordering_query_param, '').split(',')
+            if field.strip()
+        ]
+        if tuple(field.lstrip('-') for field in fields) != self.ordering[:len(fields)] \
+            or len({field.startswith('-') for field in fields}) > 1:
+            raise ValidationError({self.ordering_query_param: [self.invalid_ordering_message]})
+
+    def is_descending(self, queryset):
+        order_by = queryset.query.order_by
+        return bool(order_by) and str(order_by[0]).startswith('-') \
+            and str(order_by[0]).lstrip('-') in self.ordering
+
+    def get_position_filter(self, position, descending):
+        date, time, id = position
+        op = 'lt' if descending else 'gt'
+        #the redundant date bound lets the planner range scan the index
+        return Q(**{f'date__{op}e': date}) & (
+            Q(**{f'date__{op}': date}) |
+            Q(date = date, **{f'time__{op}': time}) |
+            Q(date = date, time = time, **{f'id__{op}': id})
+        )
+
+    def get_position(self, instance):
+        return (instance.date, instance.time, instance.id)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params[self.cursor_query_param]
+        if not encoded:
+            return None, False
+        try:
+            direction, date, time, id = urlsafe_b64decode(encoded.encode('ascii'))\
+                                        .decode('ascii').split('|')
+            position = (
+                datetime.date.fromisoformat(date),
+                datetime.time.fromisoformat(time),
+                int(id)
+            )
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, direction == 'r'
+
+    def encode_cursor(self, position, reverse):
+        date, time, id = position
+        cursor = f"{'r' if reverse else 'n'}|{date.isoformat()}|{time.isoformat()}|{id}"
+        encoded = urlsafe_b64encode(cursor.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, True)
 
 class CustomPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    '''
+        Page number pagination, switches to keyset pagination when the
+        request carries the cursor query param
+    '''
+    page_size = 10
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_pagination_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_pagination_class()
+            self.keyset.page_size = self.page_size
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+class SearchPagination(PageNumberPagination):
+    '''
+        Page number pagination of search results, which are ordered
+        by rank and can not be walked with the date based keyset
+    '''
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+class NoteCursorPagination(CursorPagination):
+    '''
+        Opt in cursor pagination of the notes of an appointment,
+        newest first, used when the request carries the cursor query param
+    '''
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-created_on'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
@@ -1,20 +1,18 @@
 from rest_framework.permissions import BasePermission
-from .models import Appointment, Note
+from .access import get_appointment_access
+from .models import Note
 
 class IsUserAppointmentOrAdmin(BasePermission):
     def has_permission(self, request, view):
         appointment_pk = view.kwargs.get('appointment_pk')
         if appointment_pk:
-            return Appointment.objects.filter(
-                id=appointment_pk,
-                created_for=request.user
-            ).exists() or request.user.is_staff
+            return get_appointment_access(request, view).is_allowed
         return False
         
     def has_object_permission(self, request, view, obj):
         if view.action == 'retrieve':
-            return obj.appointment.created_for == request.user or request.user.is_staff
+            return get_appointment_access(request, view).is_allowed
         if isinstance(obj, Note):
-            return obj.created_by == request.user or request.user.is_staff
+            return obj.created_by_id == request.user.id or request.user.is_staff
         else: 
-            return False
\ No newline at end of file
+            return False
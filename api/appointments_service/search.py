@@ -0,0 +1,131 @@
+import re
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import Case, Exists, F, FloatField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Replace
+from django.utils.html import escape
+
+from .models import Note
+
+#text search configuration the search_vector triggers are created with
+SEARCH_CONFIG = 'english'
+HEADLINE_START = '<b>'
+HEADLINE_STOP = '</b>'
+HEADLINE_WORDS = 35
+#control characters ts_headline marks the matches with, they are stripped from
+#the text first so the headline can be escaped before they become html
+MATCH_START = '\x02'
+MATCH_STOP = '\x03'
+
+def search_appointments(queryset, query):
+    '''
+        Narrows the queryset down to the appointments whose description
+        or one of whose notes match the query.
+        Annotates rank, headline and note_headline and orders by rank,
+        highlight_results turns the headlines into escaped html.
+        PostgreSQL uses the search_vector columns and their GIN indexes,
+        other databases fall back to matching every word with icontains.
+    '''
+    if connections[queryset.db].vendor == 'postgresql':
+        return search_postgresql(queryset, query)
+    return search_fallback(queryset, query)
+
+def get_headline(field, search_query):
+    text = Replace(Replace(field, Value(MATCH_START), Value('')), Value(MATCH_STOP), Value(''))
+    return SearchHeadline(
+        text,
+        search_query,
+        config = SEARCH_CONFIG,
+        start_sel = MATCH_START,
+        stop_sel = MATCH_STOP,
+        max_words = HEADLINE_WORDS
+    )
+
+def search_postgresql(queryset, query):
+    search_query = SearchQuery(query, config = SEARCH_CONFIG, search_type = 'websearch')
+    best_note = Note.objects.filter(
+                    appointment = OuterRef('pk'),
+                    search_vector = search_query
+                ).annotate(
+                    rank = SearchRank(F('search_vector'), search_query)
+                ).order_by('-rank', '-created_on')
+    return queryset.filter(
+                Q(search_vector = search_query) |
+                Q(pk__in = Note.objects.filter(search_vector = search_query).values('appointment'))
+            ).alias(
+                note_rank = Subquery(best_note.values('rank')[:1])
+            ).annotate(
+                rank = Coalesce(SearchRank(F('search_vector'), search_query), 0.0) + Coalesce(F('note_rank'), 0.0),
+                headline = get_headline('description', search_query),
+                note_headline = Subquery(best_note.annotate(
+                    headline = get_headline('description', search_query)
+                ).values('headline')[:1])
+            ).order_by('-rank', 'date', 'time', 'id')
+
+def search_fallback(queryset, query):
+    description_match = Q()
+    note_match = Q()
+    for term in query.split():
+        description_match &= Q(description__icontains = term)
+        note_match &= Q(description__icontains = term)
+    matching_notes = Note.objects.filter(
+                        note_match,
+                        appointment = OuterRef('pk')
+                    ).order_by('-created_on')
+    return queryset.annotate(
+                has_note_match = Exists(matching_notes)
+            ).filter(
+                description_match | Q(has_note_match = True)
+            ).annotate(
+                rank = Case(When(description_match, then = Value(1.0)), default = Value(0.0), output_field = FloatField()) +
+                       Case(When(has_note_match = True, then = Value(1.0)), default = Value(0.0), output_field = FloatField()),
+                headline = F('description'),
+                note_headline = Subquery(matching_notes.values('description')[:1])
+            ).order_by('-rank', 'date', 'time', 'id')
+
+def mark_headline(text):
+    '''
+        Escapes a ts_headline fragment and turns its match markers into
+        HEADLINE_START and HEADLINE_STOP
+    '''
+    if not text:
+        return text
+    return escape(text).replace(MATCH_START, HEADLINE_START).replace(MATCH_STOP, HEADLINE_STOP)
+
+def highlight(text, terms):
+    '''
+        Marks the terms in text the way ts_headline does and cuts it down
+        to HEADLINE_WORDS words around the first match.
+        The text is escaped, only the markers are html.
+    '''
+    if not text or not terms:
+        return escape(text) if text else text
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    words = text.split()
+    first = next((i for i, word in enumerate(words) if pattern.search(word)), 0)
+    start = max(0, min(first - 5, len(words) - HEADLINE_WORDS))
+    fragment = ' '.join(words[start:start + HEADLINE_WORDS])
+    pieces = []
+    position = 0
+    for match in pattern.finditer(fragment):
+        pieces.append(escape(fragment[position:match.start()]))
+        pieces.append(f'{HEADLINE_START}{escape(match.group(0))}{HEADLINE_STOP}')
+        position = match.end()
+    pieces.append(escape(fragment[position:]))
+    return ''.join(pieces)
+
+def highlight_results(results, query, using):
+    '''
+        Turns the headlines of a page of results into escaped html,
+        PostgreSQL already picked the fragments and marked the matches,
+        other databases get them built in python
+    '''
+    postgresql = connections[using].vendor == 'postgresql'
+    terms = query.split()
+    for appointment in results:
+        if postgresql:
+            appointment.headline = mark_headline(appointment.headline)
+            appointment.note_headline = mark_headline(appointment.note_headline)
+        else:
+            appointment.headline = highlight(appointment.headline, terms)
+            appointment.note_headline = highlight(appointment.note_headline, terms)
@@ -1,9 +1,15 @@
+import datetime
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 from django.utils.timezone import now
 from rest_framework import serializers
+from user_service.avatars import get_avatar_thumbnail_url
 
 from .models import Appointment, Note
-from .validators import validate_appointment_time
+from .stats import add_appointments_to_stats, apply_stats_changes
+from .versions import bump_data_versions
+from .validators import SLOT_CONSTRAINT, get_bulk_conflicting_slots, validate_appointment_time
 
 class NoteSerializer(serializers.ModelSerializer):
     created_by = serializers.StringRelatedField()
@@ -22,11 +28,13 @@ class NoteSerializer(serializers.ModelSerializer):
         ]
     
     def create(self, validated_data):
-        appointment_id = self.context['appointment_id']
+        appointment = self.context['appointment_access'].appointment
         user = self.context['user']
         
+        if appointment is None:
+            raise serializers.ValidationError({"appointment": ["Appointment does not exist."]})
         note = Note(**validated_data)
-        note.appointment_id = appointment_id
+        note.appointment = appointment
         note.created_by = user
         note.save()
         return note
@@ -40,12 +48,13 @@ class NoteSerializer(serializers.ModelSerializer):
     
     def get_is_editable(self, obj):
         user = self.context['user']
-        return user.is_staff or obj.created_by == user
+        return user.is_staff or obj.created_by_id == user.id
     
     def get_avatar(self, obj):
-        if obj.created_by and obj.created_by.avatar:
-            return obj.created_by.avatar.avatar.url
-        return None
+        try:
+            return get_avatar_thumbnail_url(obj.created_by.avatar, 'small')
+        except AttributeError:
+            return None
 
 class CreateAppointmentSerializer(serializers.ModelSerializer):
     User = get_user_model()
@@ -82,11 +91,202 @@ class CreateAppointmentSerializer(serializers.ModelSerializer):
         if not user.is_staff:
             validated_data['created_for'] = user
         
-        validate_appointment_time(validated_data, None)
-        
-        appointment = Appointment.objects.create(**validated_data)
+        appointment = Appointment(**validated_data)
+        with validate_appointment_time(appointment):
+            appointment.save()
         return appointment
     
+class BulkAppointmentItemSerializer(serializers.ModelSerializer):
+    created_for = serializers.IntegerField(allow_null=True, required=False)
+    
+    class Meta:
+        model = Appointment
+        fields = [
+            'date',
+            'time',
+            'visit_type',
+            'created_for',
+            'description'
+        ]
+
+class RecurrenceSerializer(serializers.Serializer):
+    FREQUENCIES = {
+        'daily': datetime.timedelta(days = 1),
+        'weekly': datetime.timedelta(weeks = 1)
+    }
+    
+    frequency = serializers.ChoiceField(choices=list(FREQUENCIES))
+    count = serializers.IntegerField(min_value=1, max_value=52)
+
+class BulkCreateAppointmentSerializer(serializers.Serializer):
+    '''
+        Creates a list of appointments or the occurrences of one appointment
+        following a recurrence rule.
+        Every slot is checked in one query and the batch is inserted with
+        bulk_create in a single transaction, conflicts are reported per
+        appointment in the conflicting_slots format.
+    '''
+    max_appointments = 100
+    
+    appointments = BulkAppointmentItemSerializer(many=True, required=False)
+    appointment = BulkAppointmentItemSerializer(required=False)
+    recurrence = RecurrenceSerializer(required=False)
+    
+    def validate(self, attrs):
+        if 'appointments' in attrs:
+            items = attrs['appointments']
+        elif 'appointment' in attrs and 'recurrence' in attrs:
+            step = RecurrenceSerializer.FREQUENCIES[attrs['recurrence']['frequency']]
+            items = [
+                {**attrs['appointment'], 'date': attrs['appointment']['date'] + step * occurrence}
+                for occurrence in range(attrs['recurrence']['count'])
+            ]
+        else:
+            raise serializers.ValidationError(
+                "Provide either appointments or appointment with recurrence."
+            )
+        if not items or len(items) > self.max_appointments:
+            raise serializers.ValidationError({
+                "appointments": [f"Provide between 1 and {self.max_appointments} appointments."]
+            })
+        
+        user = self.context['user']
+        if user.is_staff:
+            user_ids = {item.get('created_for') for item in items}
+            if None in user_ids:
+                raise serializers.ValidationError({"created_for": ["This field is required."]})
+            users = get_user_model().objects.in_bulk(user_ids)
+            if len(users) != len(user_ids):
+                raise serializers.ValidationError({"created_for": ["Invalid pk - object does not exist."]})
+        else:
+            users = {user.id: user}
+        
+        attrs['instances'] = [
+            Appointment(
+                **{field: value for field, value in item.items() if field != 'created_for'},
+                created_for = users[item['created_for'] if user.is_staff else user.id]
+            ) for item in items
+        ]
+        return attrs
+    
+    def create(self, validated_data):
+        appointments = validated_data['instances']
+        conflicts = get_bulk_conflicting_slots(appointments)
+        if any(conflicts):
+            raise serializers.ValidationError({"appointments": conflicts})
+        try:
+            with transaction.atomic():
+                Appointment.objects.bulk_create(appointments)
+                add_appointments_to_stats(appointments)
+                bump_data_versions({appointment.created_for_id for appointment in appointments})
+        except IntegrityError as error:
+            #a concurrent booking took one of the slots after the check
+            if SLOT_CONSTRAINT not in str(error):
+                raise
+            raise serializers.ValidationError({
+                "appointments": get_bulk_conflicting_slots(appointments)
+            })
+        return appointments
+    
+class BulkUpdateAppointmentSerializer(serializers.Serializer):
+    '''
+        Closes, reschedules or reassigns a set of appointments with
+        set based updates.
+        Only the appointments whose slot moves are checked for conflicts.
+        A filter selects at most max_appointments, like ids.
+    '''
+    max_appointments = 1000
+    
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=max_appointments)
+    is_closed = serializers.BooleanField(required=False)
+    shift_days = serializers.IntegerField(required=False, min_value=-366, max_value=366)
+    created_for = serializers.IntegerField(required=False)
+    
+    def validate(self, attrs):
+        if not any(field in attrs for field in ('is_closed', 'shift_days', 'created_for')):
+            raise serializers.ValidationError(
+                "Provide at least one of is_closed, shift_days or created_for."
+            )
+        if 'created_for' in attrs:
+            if not self.context['user'].is_staff:
+                raise serializers.ValidationError({"created_for": ["Only staff can reassign appointments."]})
+            if not get_user_model().objects.filter(id=attrs['created_for']).exists():
+                raise serializers.ValidationError({"created_for": ["Invalid pk - object does not exist."]})
+        return attrs
+    
+    def get_conflicts_error(self, moved, conflicts):
+        return serializers.ValidationError({
+            "appointments": {
+                appointment.id: conflict
+                for appointment, conflict in zip(moved, conflicts) if conflict
+            }
+        })
+    
+    def update_queryset(self, queryset):
+        data = self.validated_data
+        if 'ids' in data:
+            queryset = queryset.filter(id__in=data['ids'])
+        shift = datetime.timedelta(days = data.get('shift_days', 0))
+        
+        with transaction.atomic():
+            rows = queryset.select_related(None)\
+                    .order_by()\
+                    .select_for_update(of=('self',))\
+                    .values_list('id', 'created_for', 'date', 'time', 'is_closed')[:self.max_appointments + 1]
+            if len(rows) > self.max_appointments:
+                raise serializers.ValidationError({
+                    "ids": [f"The filter matches more than {self.max_appointments} appointments, narrow it or pass ids."]
+                })
+            
+            changes = {}
+            moved = []
+            for id, created_for, date, time, is_closed in rows:
+                new_key = (
+                    data.get('created_for', created_for),
+                    date + shift,
+                    data.get('is_closed', is_closed)
+                )
+                if new_key == (created_for, date, is_closed):
+                    continue
+                changes[id] = ((created_for, date, is_closed), new_key)
+                if new_key[:2] != (created_for, date):
+                    moved.append(Appointment(id=id, created_for_id=new_key[0], date=new_key[1], time=time))
+            
+            if moved:
+                conflicts = get_bulk_conflicting_slots(moved, [appointment.id for appointment in moved])
+                if any(conflicts):
+                    raise self.get_conflicts_error(moved, conflicts)
+            
+            if 'is_closed' in data:
+                Appointment.objects.filter(
+                    id__in=[id for id, (old_key, new_key) in changes.items() if old_key[2] != new_key[2]]
+                ).update(is_closed=data['is_closed'])
+            
+            #one update per source date, latest first when moving forward, so a
+            #moved appointment never lands on a slot that is still being vacated
+            moved_by_date = {}
+            for appointment in moved:
+                moved_by_date.setdefault(changes[appointment.id][0][1], []).append(appointment.id)
+            try:
+                with transaction.atomic():
+                    for date in sorted(moved_by_date, reverse=shift > datetime.timedelta(0)):
+                        values = {'date': date + shift}
+                        if 'created_for' in data:
+                            values['created_for_id'] = data['created_for']
+                        Appointment.objects.filter(id__in=moved_by_date[date]).update(**values)
+            except IntegrityError as error:
+                #a concurrent booking took one of the slots after the check
+                if SLOT_CONSTRAINT not in str(error):
+                    raise
+                raise self.get_conflicts_error(
+                    moved,
+                    get_bulk_conflicting_slots(moved, [appointment.id for appointment in moved])
+                )
+            
+            apply_stats_changes(changes.values())
+            bump_data_versions({key[0] for keys in changes.values() for key in keys})
+        return len(changes)
+    
 class DailyAppointmentSerailizer(serializers.ModelSerializer):
     visit_type_full = serializers.SerializerMethodField() 
 
@@ -127,10 +327,14 @@ class AppointmentSerializer(serializers.ModelSerializer):
             'created_for',
             'created_for_full_name',
             'is_closed',
-            'description'
+            'description',
+            'note_count',
+            'last_note_at'
         ]
         read_only_fields = [
             'created_for',
+            'note_count',
+            'last_note_at'
         ]
         
     def get_created_for_full_name(self, obj):
@@ -145,8 +349,25 @@ class AppointmentSerializer(serializers.ModelSerializer):
         if not user.is_staff:
             validated_data['created_for'] = user
             
-        validate_appointment_time(validated_data, instance.id)
-        return super().update(instance, validated_data)
+        with validate_appointment_time(instance):
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            #only write the edited columns so the note summary kept by the
+            #note signals is never overwritten with a stale value
+            instance.save(update_fields = list(validated_data))
+        return instance
+    
+class AppointmentSearchSerializer(AppointmentSerializer):
+    rank = serializers.FloatField(read_only=True)
+    headline = serializers.CharField(read_only=True, allow_null=True)
+    note_headline = serializers.CharField(read_only=True, allow_null=True)
+    
+    class Meta(AppointmentSerializer.Meta):
+        fields = AppointmentSerializer.Meta.fields + [
+            'rank',
+            'headline',
+            'note_headline'
+        ]
     
 class CalendarSerializer(serializers.ModelSerializer):
     created_for = serializers.StringRelatedField()
@@ -171,6 +392,31 @@ class CalendarSerializer(serializers.ModelSerializer):
         
     def get_created_for_avatar(self, obj):
         try:
-            return obj.created_for.avatar.avatar.url
+            return get_avatar_thumbnail_url(obj.created_for.avatar, 'small')
         except AttributeError:
-            return None
\ No newline at end of file
+            return None
+
+class AvailabilitySearchSerializer(serializers.Serializer):
+    max_window_days = 62
+    
+    doctor = serializers.ListField(child=serializers.IntegerField(), required=False)
+    from_date = serializers.DateField()
+    to_date = serializers.DateField()
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    #offered hours, start inclusive and end exclusive, default to the AVAILABILITY_*_HOUR settings
+    start_hour = serializers.IntegerField(min_value=0, max_value=23, required=False)
+    end_hour = serializers.IntegerField(min_value=1, max_value=24, required=False)
+    
+    def validate(self, attrs):
+        attrs.setdefault('start_hour', settings.AVAILABILITY_START_HOUR)
+        attrs.setdefault('end_hour', settings.AVAILABILITY_END_HOUR)
+        if attrs['end_hour'] <= attrs['start_hour']:
+            raise serializers.ValidationError({"end_hour": ["Must be after start_hour."]})
+        window = (attrs['to_date'] - attrs['from_date']).days
+        if window < 0:
+            raise serializers.ValidationError({"to_date": ["Must not be before from_date."]})
+        if window > self.max_window_days:
+            raise serializers.ValidationError({
+                "to_date": [f"Date range cannot be longer than {self.max_window_days} days."]
+            })
+        return attrs
@@ -0,0 +1,76 @@
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from appointments_service.models import Appointment, Note
+from appointments_service.stats import adjust_appointment_stats
+from appointments_service.versions import bump_data_versions
+
+@receiver(pre_save, sender=Appointment)
+def load_appointment_stats_key(sender, instance, **kwargs):
+    #fetch the stored bucket for instances that were not loaded from the db
+    if instance.pk and getattr(instance, '_loaded_stats_key', None) is None:
+        instance._loaded_stats_key = Appointment.objects.filter(
+            pk = instance.pk
+        ).values_list('created_for_id', 'date', 'is_closed').first()
+
+#connected before the stats handler, which replaces _loaded_stats_key
+@receiver(post_save, sender=Appointment)
+def bump_versions_on_appointment_save(sender, instance, **kwargs):
+    owners = {
+        key[0] for key in (getattr(instance, '_loaded_stats_key', None), instance.get_stats_key()) if key
+    }
+    bump_data_versions(owners)
+
+@receiver(post_save, sender=Appointment)
+def update_appointment_stats_on_save(sender, instance, created, **kwargs):
+    old_key = None if created else getattr(instance, '_loaded_stats_key', None)
+    new_key = instance.get_stats_key()
+    if new_key is None:
+        instance.refresh_from_db(fields=['created_for', 'date', 'is_closed'])
+        new_key = instance.get_stats_key()
+    if old_key == new_key:
+        return
+    if old_key:
+        user_id, date, is_closed = old_key
+        adjust_appointment_stats(user_id, date, -1, -int(is_closed))
+    user_id, date, is_closed = new_key
+    adjust_appointment_stats(user_id, date, 1, int(is_closed))
+    instance._loaded_stats_key = new_key
+
+@receiver(post_delete, sender=Appointment)
+def update_appointment_stats_on_delete(sender, instance, **kwargs):
+    stats_key = getattr(instance, '_loaded_stats_key', None) or instance.get_stats_key()
+    if stats_key:
+        user_id, date, is_closed = stats_key
+        adjust_appointment_stats(user_id, date, -1, -int(is_closed))
+    bump_data_versions({stats_key[0] if stats_key else instance.__dict__.get('created_for_id')})
+
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+def bump_versions_on_note_write(sender, instance, **kwargs):
+    #the note summary is part of the appointment rows
+    if Note.appointment.is_cached(instance):
+        owner = instance.appointment.created_for_id
+    else:
+        owner = Appointment.objects.filter(pk = instance.appointment_id)\
+                .values_list('created_for_id', flat = True).first()
+    bump_data_versions({owner})
+
+@receiver(post_save, sender=Note)
+def update_note_summary_on_save(sender, instance, created, **kwargs):
+    #created_on is reset on every edit so the saved note is always the latest
+    summary = {'last_note_at': instance.created_on}
+    if created:
+        summary['note_count'] = F('note_count') + 1
+    Appointment.objects.filter(pk = instance.appointment_id).update(**summary)
+
+@receiver(post_delete, sender=Note)
+def update_note_summary_on_delete(sender, instance, **kwargs):
+    Appointment.objects.filter(pk = instance.appointment_id).update(
+        note_count = F('note_count') - 1,
+        last_note_at = Subquery(
+            Note.objects.filter(
+                appointment = OuterRef('pk')
+            ).order_by('-created_on').values('created_on')[:1]
+        )
+    )
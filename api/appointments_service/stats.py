@@ -0,0 +1,143 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from .models import Appointment, AppointmentStats
+
+def adjust_stats_bucket(user_id, date, total, closed):
+    '''
+        Shifts the counters of one bucket by the given deltas.
+        Buckets are only created for positive deltas so that cascading
+        deletes never recreate rows for a user being removed.
+    '''
+    bucket = AppointmentStats.objects.filter(
+        user_id = user_id,
+        date = date
+    )
+    changes = {
+        'total': F('total') + total,
+        'closed': F('closed') + closed
+    }
+    if bucket.update(**changes) or total <= 0:
+        return
+    try:
+        #savepoint, so a failed insert leaves the surrounding transaction usable
+        with transaction.atomic():
+            AppointmentStats.objects.create(
+                user_id = user_id,
+                date = date,
+                total = total,
+                closed = closed
+            )
+    except IntegrityError:
+        #a concurrent first write created the bucket after the update
+        bucket.update(**changes)
+
+def adjust_appointment_stats(user_id, date, total, closed):
+    '''
+        Shifts the counters of the date bucket and the lifetime bucket
+        of a user by the given deltas
+    '''
+    with transaction.atomic():
+        for bucket in (None, date):
+            adjust_stats_bucket(user_id, bucket, total, closed)
+
+def apply_stats_changes(changes):
+    '''
+        Moves the counters of appointments written without signals,
+        e.g. bulk_create or QuerySet.update, with one update per touched bucket.
+        changes is an iterable of (old_key, new_key) pairs of stats keys,
+        old_key is None for created appointments and new_key for deleted ones.
+    '''
+    deltas = {}
+    for old_key, new_key in changes:
+        for key, sign in ((old_key, -1), (new_key, 1)):
+            if key is None:
+                continue
+            user_id, date, is_closed = key
+            for bucket in (None, date):
+                delta = deltas.setdefault((user_id, bucket), [0, 0])
+                delta[0] += sign
+                delta[1] += sign * int(is_closed)
+    with transaction.atomic():
+        for (user_id, bucket), (total, closed) in deltas.items():
+            if total or closed:
+                adjust_stats_bucket(user_id, bucket, total, closed)
+
+def add_appointments_to_stats(appointments):
+    apply_stats_changes(
+        (None, appointment.get_stats_key()) for appointment in appointments
+    )
+
+def rebuild_appointment_stats(user_ids = None):
+    '''
+        Recomputes the stats buckets from the appointments table.
+        If user_ids is given only those users are rebuilt.
+    '''
+    appointments = Appointment.objects.all()
+    stats = AppointmentStats.objects.all()
+    if user_ids is not None:
+        appointments = appointments.filter(created_for__in = user_ids)
+        stats = stats.filter(user__in = user_ids)
+
+    buckets = appointments.values(
+                'created_for',
+                'date'
+            ).annotate(
+                total = Count('id'),
+                closed = Count('id', filter = Q(is_closed = True))
+            ).order_by()
+
+    rows = []
+    lifetime = {}
+    for bucket in buckets.iterator():
+        rows.append(AppointmentStats(
+            user_id = bucket['created_for'],
+            date = bucket['date'],
+            total = bucket['total'],
+            closed = bucket['closed']
+        ))
+        user_total = lifetime.setdefault(bucket['created_for'], [0, 0])
+        user_total[0] += bucket['total']
+        user_total[1] += bucket['closed']
+    rows.extend(
+        AppointmentStats(
+            user_id = user_id,
+            date = None,
+            total = total,
+            closed = closed
+        ) for user_id, (total, closed) in lifetime.items()
+    )
+
+    with transaction.atomic():
+        stats.delete()
+        AppointmentStats.objects.bulk_create(rows, batch_size = 1000)
+    return len(rows)
+
+def get_user_stats_query(user, today):
+    '''
+        Reads the lifetime row and the buckets from today onwards,
+        which is independent of how much history the user has.
+        Returns the queryset and the aggregates of the lifetime counters
+        and the date based today counters, the time based split of today
+        is left to the caller.
+    '''
+    queryset = AppointmentStats.objects.filter(
+                    user = user
+                ).filter(
+                    Q(date__isnull = True) | Q(date__gte = today)
+                )
+    return queryset, {
+        'l_total': Sum('total', filter = Q(date__isnull = True), default = 0),
+        'l_closed': Sum('closed', filter = Q(date__isnull = True), default = 0),
+        'l_open': Sum(F('total') - F('closed'), filter = Q(date__gte = today), default = 0),
+        't_total': Sum('total', filter = Q(date = today), default = 0),
+        't_closed': Sum('closed', filter = Q(date = today), default = 0)
+    }
+
+def get_user_stats(user, today):
+    queryset, aggregates = get_user_stats_query(user, today)
+    return queryset.aggregate(**aggregates)
+
+async def aget_user_stats(user, today):
+    queryset, aggregates = get_user_stats_query(user, today)
+    return await queryset.aaggregate(**aggregates)
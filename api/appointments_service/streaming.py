@@ -0,0 +1,24 @@
+import json
+from rest_framework.utils.encoders import JSONEncoder
+
+def stream_json_list(serializer, queryset, chunk_size = 500):
+    '''
+        Yields the serialized queryset as a JSON array.
+        Rows are read through a server side cursor and flushed once per
+        chunk so memory stays flat regardless of the number of rows.
+    '''
+    yield '['
+    separator = ''
+    chunk = []
+    for instance in queryset.iterator(chunk_size = chunk_size):
+        chunk.append(separator + json.dumps(
+            serializer.to_representation(instance),
+            cls = JSONEncoder
+        ))
+        separator = ','
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+    yield ']'
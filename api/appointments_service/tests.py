@@ -1,3 +1,996 @@
-from django.test import TestCase
+import datetime
+import json
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from . import async_views
+from .availability import find_free_slots
+from .checks import check_shared_cache
+from .models import Appointment, AppointmentStats, Note
+from .search import mark_headline
+from .serializers import BulkUpdateAppointmentSerializer
+from .stats import adjust_stats_bucket, rebuild_appointment_stats
+from .validators import get_bulk_conflicting_slots
+from .versions import get_version_key
+from .views import CalendarView
+
+User = get_user_model()
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user = self.user)
+        today = datetime.date.today()
+        yesterday = today - datetime.timedelta(days = 1)
+        tomorrow = today + datetime.timedelta(days = 1)
+        self.appointments = [
+            Appointment.objects.create(date = yesterday, time = datetime.time(9), visit_type = 'I', created_for = self.user),
+            Appointment.objects.create(date = yesterday, time = datetime.time(10), visit_type = 'I', created_for = self.user, is_closed = True),
+            Appointment.objects.create(date = today, time = datetime.time(0), visit_type = 'V', created_for = self.user, is_closed = True),
+            Appointment.objects.create(date = tomorrow, time = datetime.time(9), visit_type = 'V', created_for = self.user),
+        ]
+
+    def test_dashboard_query_budget(self):
+        #one read of the stats buckets, the appointments table is only
+        #queried for the time split when something is still open today
+        with self.assertNumQueries(1):
+            response = self.client.get('/appointments/stats')
+        self.assertEqual(response.status_code, 200)
+        with self.captureOnCommitCallbacks(execute = True):
+            Appointment.objects.create(
+                date = datetime.date.today(),
+                time = datetime.time(23, 59),
+                visit_type = 'V',
+                created_for = self.user
+            )
+        with self.assertNumQueries(2):
+            self.client.get('/appointments/stats')
+        #the day is cached until the next write
+        with self.assertNumQueries(0):
+            self.client.get('/appointments/stats')
+
+    def test_today_is_cached_until_a_write(self):
+        response = self.client.get('/appointments/today')
+        self.assertEqual([row['id'] for row in response.data], [self.appointments[2].id])
+        with self.assertNumQueries(0):
+            self.client.get('/appointments/today')
+        with self.captureOnCommitCallbacks(execute = True):
+            self.appointments[2].description = 'Updated'
+            self.appointments[2].save()
+        response = self.client.get('/appointments/today')
+        self.assertEqual(response.data[0]['description'], 'Updated')
+
+    def test_dashboard_counts(self):
+        response = self.client.get('/appointments/stats')
+        self.assertEqual(response.data['lifetime'], {
+            'total': 4,
+            'open': 1,
+            'closed': 2,
+            'past_due': 1
+        })
+        self.assertEqual(response.data['today']['total'], 1)
+        self.assertEqual(response.data['today']['closed'], 1)
+
+    def test_stats_follow_appointment_writes(self):
+        tomorrow = datetime.date.today() + datetime.timedelta(days = 1)
+        appointment = self.appointments[0]
+        appointment.date = tomorrow
+        appointment.time = datetime.time(15)
+        appointment.is_closed = True
+        appointment.save()
+        self.appointments[1].delete()
+        lifetime = AppointmentStats.objects.get(user = self.user, date = None)
+        self.assertEqual((lifetime.total, lifetime.closed), (3, 2))
+        bucket = AppointmentStats.objects.get(user = self.user, date = tomorrow)
+        self.assertEqual((bucket.total, bucket.closed), (2, 1))
+
+    def test_concurrently_created_bucket_is_updated(self):
+        date = datetime.date(2030, 1, 1)
+        AppointmentStats.objects.create(user = self.user, date = date, total = 1, closed = 0)
+        update = QuerySet.update
+        missed = []
+        def racing_update(queryset, **kwargs):
+            #the first update runs before the concurrent insert commits
+            if not missed:
+                missed.append(True)
+                return 0
+            return update(queryset, **kwargs)
+        with mock.patch.object(QuerySet, 'update', autospec = True, side_effect = racing_update):
+            adjust_stats_bucket(self.user.id, date, 1, 1)
+        bucket = AppointmentStats.objects.get(user = self.user, date = date)
+        self.assertEqual((bucket.total, bucket.closed), (2, 1))
+
+    def test_rebuild_matches_incremental_stats(self):
+        self.appointments[3].delete()
+        expected = set(AppointmentStats.objects.values_list('user', 'date', 'total', 'closed'))
+        rebuild_appointment_stats()
+        actual = set(AppointmentStats.objects.values_list('user', 'date', 'total', 'closed'))
+        self.assertEqual(
+            {row for row in actual if row[2]},
+            {row for row in expected if row[2]}
+        )
+
+class AppointmentIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([
+            User(username = f'doctor{i}', email = f'doctor{i}@example.com')
+            for i in range(20)
+        ])
+        start = datetime.date(2024, 1, 1)
+        Appointment.objects.bulk_create([
+            Appointment(
+                date = start + datetime.timedelta(days = day),
+                time = datetime.time(hour),
+                visit_type = 'I',
+                created_for = user,
+                is_closed = day < 300
+            )
+            for user in users
+            for day in range(0, 365, 3)
+            for hour in (9, 13)
+        ])
+        cls.user = users[0]
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertIndexedPlan(self, queryset, ordered = False):
+        #plan wording differs between postgres (Seq Scan / Sort) and sqlite (SCAN / TEMP B-TREE)
+        plan = queryset.explain()
+        self.assertNotIn(f'Seq Scan on {Appointment._meta.db_table}', plan)
+        self.assertNotRegex(plan, r'\bSCAN \w+\b(?! USING)')
+        self.assertRegex(plan, r'appointment_\w+_idx')
+        if ordered:
+            self.assertNotRegex(plan, r'\bSort\b|TEMP B-TREE FOR ORDER BY')
+
+    def test_user_list_uses_index(self):
+        self.assertIndexedPlan(
+            Appointment.objects.filter(created_for = self.user).order_by('date', 'time'),
+            ordered = True
+        )
+
+    def test_todays_appointments_use_index(self):
+        self.assertIndexedPlan(
+            Appointment.objects.filter(
+                created_for = self.user,
+                date = datetime.date(2024, 6, 1)
+            ).order_by('time'),
+            ordered = True
+        )
+
+    def test_open_appointments_use_index(self):
+        self.assertIndexedPlan(
+            Appointment.objects.filter(
+                created_for = self.user,
+                date__lt = datetime.date(2024, 12, 1),
+                is_closed = False
+            )
+        )
+
+    def test_calendar_range_uses_index(self):
+        self.assertIndexedPlan(
+            CalendarView.queryset.filter(
+                date__gt = datetime.date(2024, 3, 1),
+                date__lt = datetime.date(2024, 3, 8)
+            ),
+            ordered = True
+        )
+
+class SlotConflictTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user = self.user)
+        self.date = datetime.date(2030, 1, 1)
+        self.appointment = Appointment.objects.create(
+            date = self.date,
+            time = datetime.time(9),
+            visit_type = 'I',
+            created_for = self.user
+        )
+
+    def test_create_in_taken_hour_reports_conflicting_slots(self):
+        response = self.client.post('/appointments/', {
+            'date': self.date,
+            'time': '09:30',
+            'visit_type': 'V'
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['conflicting_slots'], ['09 AM'])
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_update_into_taken_hour_reports_conflicting_slots(self):
+        other = Appointment.objects.create(
+            date = self.date,
+            time = datetime.time(11),
+            visit_type = 'I',
+            created_for = self.user
+        )
+        response = self.client.patch(f'/appointments/{other.id}/', {
+            'date': self.date,
+            'time': '09:15'
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['conflicting_slots'], ['09 AM'])
+
+    def test_update_within_own_slot_is_allowed(self):
+        response = self.client.patch(f'/appointments/{self.appointment.id}/', {
+            'date': self.date,
+            'time': '09:45'
+        })
+        self.assertEqual(response.status_code, 200)
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            username = 'admin',
+            email = 'admin@example.com',
+            password = 'password',
+            is_staff = True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user = self.staff)
+        self.appointments = [
+            Appointment.objects.create(
+                date = datetime.date(2030, 1, 1 + day),
+                time = datetime.time(hour),
+                visit_type = 'I',
+                created_for = self.staff,
+                is_closed = hour == 9
+            )
+            for day in range(5)
+            for hour in (9, 10, 11)
+        ]
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_pages_follow_date_time_id_order(self):
+        ids = self.walk('/appointments/?cursor=&page_size=4')
+        self.assertEqual(ids, [appointment.id for appointment in self.appointments])
+
+    def test_descending_ordering_with_filter(self):
+        ids = self.walk('/appointments/?cursor=&page_size=4&ordering=-date&is_closed=false')
+        expected = [appointment.id for appointment in self.appointments if not appointment.is_closed]
+        self.assertEqual(ids, expected[::-1])
+
+    def test_unsupported_ordering_is_rejected(self):
+        for ordering in ('created_for', 'date,created_for', '-date,time', 'id', 'time', 'time,date', 'date,id'):
+            response = self.client.get('/appointments/', {'cursor': '', 'ordering': ordering})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('ordering', response.data)
+        for ordering in ('date', '-date,-time', 'date,time,id'):
+            response = self.client.get('/appointments/', {'cursor': '', 'ordering': ordering})
+            self.assertEqual(response.status_code, 200)
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get('/appointments/?cursor=&page_size=4').data
+        second = self.client.get(first['next']).data
+        self.assertIsNone(first['previous'])
+        back = self.client.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_page_number_pagination_is_the_default(self):
+        response = self.client.get('/appointments/')
+        self.assertEqual(response.data['count'], 15)
+
+class CalendarTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            username = 'admin',
+            email = 'admin@example.com',
+            password = 'password',
+            is_staff = True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user = self.staff)
+        for day in range(1, 8):
+            Appointment.objects.create(
+                date = datetime.date(2030, 1, day),
+                time = datetime.time(9),
+                visit_type = 'I',
+                created_for = self.staff
+            )
+
+    def test_date_range_is_required(self):
+        response = self.client.get('/appointments/calendar')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date__gt', response.data)
+        self.assertIn('date__lt', response.data)
+
+    def test_date_range_is_bounded(self):
+        response = self.client.get('/appointments/calendar', {
+            'date__gt': '2030-01-01',
+            'date__lt': '2030-12-31'
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date__lt', response.data)
+
+    def test_stream_takes_a_year(self):
+        response = self.client.get('/appointments/calendar', {
+            'date__gt': '2029-12-31',
+            'date__lt': '2031-01-01',
+            'stream': 'true'
+        })
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 7)
+        response = self.client.get('/appointments/calendar', {
+            'date__gt': '2029-12-31',
+            'date__lt': '2031-01-02',
+            'stream': 'true'
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date__lt', response.data)
+
+    def test_stream_matches_list(self):
+        params = {'date__gt': '2029-12-31', 'date__lt': '2030-01-06'}
+        response = self.client.get('/appointments/calendar', params)
+        streamed = self.client.get('/appointments/calendar', {**params, 'stream': 'true'})
+        self.assertTrue(streamed.streaming)
+        body = json.loads(b''.join(streamed.streaming_content))
+        self.assertEqual(len(body), 5)
+        self.assertEqual(body, json.loads(response.content))
+
+    def test_density_counts_per_day(self):
+        other = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password'
+        )
+        Appointment.objects.create(
+            date = datetime.date(2030, 1, 2),
+            time = datetime.time(9),
+            visit_type = 'V',
+            created_for = other,
+            is_closed = True
+        )
+        params = {'date__gt': '2030-01-01', 'date__lt': '2030-01-04'}
+        with self.assertNumQueries(1):
+            response = self.client.get('/appointments/calendar/density', params)
+        self.assertEqual(
+            [(day['date'], day['total'], day['closed']) for day in response.data],
+            [(datetime.date(2030, 1, 2), 2, 1), (datetime.date(2030, 1, 3), 1, 0)]
+        )
+        detail = self.client.get(response.data[0]['detail'])
+        self.assertEqual(len(detail.data), 2)
+        response = self.client.get('/appointments/calendar/density', {**params, 'group_by': 'doctor'})
+        self.assertEqual(
+            [doctor['id'] for doctor in response.data[0]['doctors']],
+            [self.staff.id, other.id]
+        )
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        self.doctors = [
+            User.objects.create_user(
+                username = f'doctor{i}',
+                email = f'doctor{i}@example.com',
+                password = 'password'
+            )
+            for i in range(2)
+        ]
+        self.date = datetime.date(2030, 1, 1)
+        for doctor in self.doctors:
+            for hour in range(9, 17):
+                if hour != 15:
+                    Appointment.objects.create(
+                        date = self.date,
+                        time = datetime.time(hour, 30),
+                        visit_type = 'I',
+                        created_for = doctor
+                    )
+
+    def test_free_slots_are_ordered_by_date_hour_and_doctor(self):
+        ids = sorted(doctor.id for doctor in self.doctors)
+        with self.assertNumQueries(1):
+            openings = find_free_slots(
+                ids,
+                self.date,
+                self.date + datetime.timedelta(days = 1),
+                limit = 3,
+                now = datetime.datetime(2029, 12, 31, 12)
+            )
+        self.assertEqual(openings, [
+            (self.date, datetime.time(15), ids[0]),
+            (self.date, datetime.time(15), ids[1]),
+            (self.date + datetime.timedelta(days = 1), datetime.time(9), ids[0]),
+        ])
+
+    def test_started_hours_are_skipped(self):
+        openings = find_free_slots(
+            [self.doctors[0].id],
+            self.date,
+            self.date,
+            limit = 10,
+            now = datetime.datetime(2030, 1, 1, 15, 10)
+        )
+        self.assertEqual(openings, [])
+
+    def test_doctor_only_sees_own_openings(self):
+        client = APIClient()
+        client.force_authenticate(user = self.doctors[0])
+        response = client.get('/appointments/availability', {
+            'from_date': '2030-01-01',
+            'to_date': '2030-01-01',
+            'doctor': self.doctors[1].id
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(opening['time'], opening['created_for']) for opening in response.data],
+            [(datetime.time(15), self.doctors[0].id)]
+        )
+
+    def test_hours_follow_the_request_and_the_settings(self):
+        client = APIClient()
+        client.force_authenticate(user = self.doctors[0])
+        params = {'from_date': '2030-01-01', 'to_date': '2030-01-01'}
+        response = client.get('/appointments/availability', {**params, 'start_hour': 20, 'end_hour': 24})
+        self.assertEqual(
+            [opening['time'] for opening in response.data],
+            [datetime.time(hour) for hour in range(20, 24)]
+        )
+        with self.settings(AVAILABILITY_START_HOUR = 0, AVAILABILITY_END_HOUR = 2):
+            response = client.get('/appointments/availability', params)
+        self.assertEqual([opening['time'] for opening in response.data], [datetime.time(0), datetime.time(1)])
+        response = client.get('/appointments/availability', {**params, 'start_hour': 10, 'end_hour': 10})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('end_hour', response.data)
+
+class BulkCreateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user = self.user)
+        self.date = datetime.date(2030, 1, 7)
+
+    def test_weekly_recurrence_is_created_in_one_batch(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/appointments/bulk/', {
+                'appointment': {'date': self.date, 'time': '10:00', 'visit_type': 'I'},
+                'recurrence': {'frequency': 'weekly', 'count': 12}
+            }, format = 'json')
+        self.assertEqual(response.status_code, 201)
+        #one conflict check and one insert against the appointments table
+        table = f'"{Appointment._meta.db_table}"'
+        self.assertEqual(len([query for query in queries if table in query['sql']]), 2)
+        self.assertEqual(len(response.data), 12)
+        self.assertEqual(response.data[-1]['date'], '2030-03-25')
+        self.assertEqual(AppointmentStats.objects.get(user = self.user, date = None).total, 12)
+
+    def test_conflicts_are_reported_per_appointment(self):
+        Appointment.objects.create(
+            date = self.date,
+            time = datetime.time(9),
+            visit_type = 'I',
+            created_for = self.user
+        )
+        response = self.client.post('/appointments/bulk/', {
+            'appointments': [
+                {'date': self.date, 'time': '11:00', 'visit_type': 'I'},
+                {'date': self.date, 'time': '09:30', 'visit_type': 'I'},
+                {'date': self.date, 'time': '11:45', 'visit_type': 'V'},
+            ]
+        }, format = 'json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['appointments'], [
+            {},
+            {'conflicting_slots': ['09 AM', '11 AM']},
+            {'conflicting_slots': ['09 AM', '11 AM']},
+        ])
+        self.assertEqual(Appointment.objects.count(), 1)
+
+class BulkUpdateTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            username = 'admin',
+            email = 'admin@example.com',
+            password = 'password',
+            is_staff = True
+        )
+        self.doctor = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user = self.staff)
+        self.date = datetime.date(2030, 1, 7)
+        self.series = [
+            Appointment.objects.create(
+                date = self.date + datetime.timedelta(weeks = week),
+                time = datetime.time(10),
+                visit_type = 'I',
+                created_for = self.doctor
+            )
+            for week in range(4)
+        ]
+
+    def test_close_by_filter(self):
+        response = self.client.post(
+            f'/appointments/bulk-update/?date={self.date}',
+            {'is_closed': True},
+            format = 'json'
+        )
+        self.assertEqual(response.data, {'updated': 1})
+        self.assertTrue(Appointment.objects.get(id = self.series[0].id).is_closed)
+        self.assertEqual(AppointmentStats.objects.get(user = self.doctor, date = None).closed, 1)
+
+    def test_shift_series_into_its_own_slots(self):
+        response = self.client.post('/appointments/bulk-update/', {
+            'ids': [appointment.id for appointment in self.series],
+            'shift_days': 7
+        }, format = 'json')
+        self.assertEqual(response.data, {'updated': 4})
+        self.assertEqual(
+            list(Appointment.objects.order_by('date').values_list('date', flat = True)),
+            [self.date + datetime.timedelta(weeks = week) for week in range(1, 5)]
+        )
+        self.assertFalse(AppointmentStats.objects.filter(user = self.doctor, date = self.date, total__gt = 0).exists())
+
+    def test_only_moved_appointments_report_conflicts(self):
+        blocker = Appointment.objects.create(
+            date = self.date,
+            time = datetime.time(10, 30),
+            visit_type = 'I',
+            created_for = self.staff
+        )
+        response = self.client.post('/appointments/bulk-update/', {
+            'ids': [self.series[0].id, blocker.id],
+            'created_for': self.staff.id
+        }, format = 'json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['appointments'], {
+            self.series[0].id: {'conflicting_slots': ['10 AM']}
+        })
+
+    def test_requires_ids_or_filter(self):
+        response = self.client.post('/appointments/bulk-update/', {'is_closed': True}, format = 'json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_or_empty_params_are_not_a_filter(self):
+        for query in ('doctr=3', 'page=1', 'ordering=', 'format=json', 'date=', 'created_for=%20'):
+            response = self.client.post(f'/appointments/bulk-update/?{query}', {'is_closed': True}, format = 'json')
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn('ids', response.data)
+        response = self.client.post('/appointments/bulk-update/?date=soon', {'is_closed': True}, format = 'json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date', response.data)
+        self.assertFalse(Appointment.objects.filter(is_closed = True).exists())
+
+    def test_concurrent_booking_is_reported_as_conflict(self):
+        target = self.date + datetime.timedelta(days = 1)
+        Appointment.objects.create(date = target, time = datetime.time(10, 30), visit_type = 'I', created_for = self.doctor)
+        checks = []
+        def check_after_the_booking(*args):
+            #the first check runs before the concurrent booking is committed
+            checks.append(args)
+            return [{}] * len(args[0]) if len(checks) == 1 else get_bulk_conflicting_slots(*args)
+        with mock.patch('appointments_service.serializers.get_bulk_conflicting_slots', side_effect = check_after_the_booking):
+            response = self.client.post('/appointments/bulk-update/', {
+                'ids': [self.series[0].id],
+                'shift_days': 1
+            }, format = 'json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['appointments'], {
+            self.series[0].id: {'conflicting_slots': ['10 AM']}
+        })
+        self.assertEqual(Appointment.objects.get(id = self.series[0].id).date, self.date)
+
+    def test_filter_is_bounded(self):
+        with mock.patch.object(BulkUpdateAppointmentSerializer, 'max_appointments', 3):
+            response = self.client.post('/appointments/bulk-update/?visit_type=I', {'is_closed': True}, format = 'json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ids', response.data)
+        self.assertFalse(Appointment.objects.filter(is_closed = True).exists())
+
+class NoteAccessTests(TestCase):
+    def setUp(self):
+        self.doctor = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password'
+        )
+        self.other = User.objects.create_user(
+            username = 'other',
+            email = 'other@example.com',
+            password = 'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user = self.doctor)
+        self.appointment = Appointment.objects.create(
+            date = datetime.date(2030, 1, 1),
+            time = datetime.time(9),
+            visit_type = 'I',
+            created_for = self.doctor
+        )
+        self.url = f'/appointments/{self.appointment.id}/notes/'
+
+    def test_list_resolves_access_once(self):
+        self.client.post(self.url, {'description': 'first'})
+        #one query for the appointment access and one for the notes
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 1)
+        self.assertTrue(response.data[0]['is_editable'])
+
+    def test_other_users_are_denied(self):
+        self.client.force_authenticate(user = self.other)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(self.client.post(self.url, {'description': 'note'}).status_code, 403)
+
+    def test_note_summary_follows_note_writes(self):
+        first = self.client.post(self.url, {'description': 'first'}).data
+        second = self.client.post(self.url, {'description': 'second'}).data
+        appointment = self.client.get(f'/appointments/{self.appointment.id}/').data
+        self.assertEqual(appointment['note_count'], 2)
+        self.client.delete(f"{self.url}{second['id']}/")
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.note_count, 1)
+        self.assertEqual(
+            self.appointment.last_note_at,
+            Note.objects.get(id = first['id']).created_on
+        )
+
+    def test_notes_cursor_pagination_is_opt_in(self):
+        for index in range(3):
+            self.client.post(self.url, {'description': f'note {index}'})
+        self.assertEqual(len(self.client.get(self.url).data), 3)
+        page = self.client.get(self.url, {'cursor': '', 'page_size': 2}).data
+        self.assertEqual([note['description'] for note in page['results']], ['note 2', 'note 1'])
+        page = self.client.get(page['next']).data
+        self.assertEqual([note['description'] for note in page['results']], ['note 0'])
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.doctor = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password'
+        )
+        self.other = User.objects.create_user(
+            username = 'other',
+            email = 'other@example.com',
+            password = 'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user = self.doctor)
+        self.by_description = Appointment.objects.create(
+            date = datetime.date(2030, 1, 1),
+            time = datetime.time(9),
+            visit_type = 'I',
+            created_for = self.doctor,
+            description = 'Follow up on the knee injury'
+        )
+        self.by_note = Appointment.objects.create(
+            date = datetime.date(2030, 1, 2),
+            time = datetime.time(9),
+            visit_type = 'I',
+            created_for = self.doctor,
+            description = 'Routine check'
+        )
+        Note.objects.create(appointment = self.by_note, description = 'Patient mentioned knee pain', created_by = self.doctor)
+        Appointment.objects.create(
+            date = datetime.date(2030, 1, 1),
+            time = datetime.time(9),
+            visit_type = 'I',
+            created_for = self.other,
+            description = 'Knee surgery'
+        )
+
+    def test_search_matches_descriptions_and_notes(self):
+        response = self.client.get('/appointments/search/', {'q': 'knee'})
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([result['id'] for result in results], [self.by_description.id, self.by_note.id])
+        self.assertIn('<b>knee</b>', results[0]['headline'])
+        self.assertIsNone(results[0]['note_headline'])
+        self.assertIn('<b>knee</b>', results[1]['note_headline'])
+
+    def test_search_is_scoped_like_the_list(self):
+        response = self.client.get('/appointments/search/', {'q': 'surgery'})
+        self.assertEqual(response.data['count'], 0)
+        self.doctor.is_staff = True
+        self.doctor.save()
+        response = self.client.get('/appointments/search/', {'q': 'knee', 'date': '2030-01-01'})
+        self.assertEqual(response.data['count'], 2)
+
+    def test_headlines_escape_the_text(self):
+        Note.objects.create(
+            appointment = self.by_description,
+            description = 'knee <img src=x onerror=alert(1)> & swelling',
+            created_by = self.doctor
+        )
+        results = self.client.get('/appointments/search/', {'q': 'knee'}).data['results']
+        self.assertEqual(
+            results[0]['note_headline'],
+            '<b>knee</b> &lt;img src=x onerror=alert(1)&gt; &amp; swelling'
+        )
+
+    def test_postgresql_headlines_are_escaped(self):
+        self.assertEqual(
+            mark_headline('\x02knee\x03 <script>'),
+            '<b>knee</b> &lt;script&gt;'
+        )
+
+    def test_search_requires_query(self):
+        self.assertEqual(self.client.get('/appointments/search/').status_code, 400)
+
+    def test_lists_do_not_load_the_search_vector(self):
+        self.assertEqual(Appointment.objects.get(id = self.by_note.id).get_deferred_fields(), {'search_vector'})
+
+class NameFilterTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            username = 'staff',
+            email = 'staff@example.com',
+            password = 'password',
+            first_name = 'Mary',
+            last_name = 'Jones',
+            is_staff = True
+        )
+        self.doctor = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password',
+            first_name = 'Ann',
+            last_name = 'Smith'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user = self.staff)
+        for user in (self.staff, self.doctor):
+            Appointment.objects.create(
+                date = datetime.date(2030, 1, 1),
+                time = datetime.time(9),
+                visit_type = 'I',
+                created_for = user
+            )
+
+    def filter_names(self, url, **params):
+        data = self.client.get(url, params).data
+        results = data['results'] if isinstance(data, dict) else data
+        return [result['created_for'] for result in results]
+
+    def test_list_and_calendar_filter_on_full_name(self):
+        self.assertEqual(self.filter_names('/appointments/', created_for = 'SMI'), [self.doctor.id])
+        self.assertEqual(self.filter_names('/appointments/', created_for = ' ann  smith '), [self.doctor.id])
+        self.assertEqual(self.filter_names('/appointments/', created_for = 'ann jones'), [])
+        names = self.filter_names(
+            '/appointments/calendar',
+            created_for = 'mary',
+            date__gt = '2029-12-31',
+            date__lt = '2030-01-02'
+        )
+        self.assertEqual(names, ['Mary Jones'])
+
+    def test_search_name_follows_name_changes(self):
+        self.doctor.last_name = 'Brown'
+        self.doctor.save(update_fields = ['last_name'])
+        self.doctor.refresh_from_db()
+        self.assertEqual(self.doctor.search_name, 'ann brown')
+        self.assertEqual(self.filter_names('/appointments/', created_for = 'brown'), [self.doctor.id])
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            username = 'staff',
+            email = 'staff@example.com',
+            password = 'password',
+            first_name = 'Mary',
+            last_name = 'Jones',
+            is_staff = True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user = self.staff)
+        self.appointments = [
+            Appointment.objects.create(
+                date = datetime.date(2030, 1, day),
+                time = datetime.time(9),
+                visit_type = 'I',
+                created_for = self.staff,
+                description = 'Long description'
+            ) for day in range(1, 4)
+        ]
+
+    def get_appointment_selects(self, url, params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        selects = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('SELECT') and 'appointments_service_appointment' in query['sql']
+            and 'COUNT(' not in query['sql']
+        ]
+        return response, selects
+
+    def test_lists_defer_description_by_default(self):
+        response, selects = self.get_appointment_selects('/appointments/', {})
+        self.assertNotIn('description', response.data['results'][0])
+        self.assertEqual(response.data['results'][0]['created_for_full_name'], 'Mary Jones')
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn('"description"', selects[0])
+        detail = self.client.get(f'/appointments/{self.appointments[0].id}/').data
+        self.assertEqual(detail['description'], 'Long description')
+
+    def test_fields_trim_output_and_columns(self):
+        response, selects = self.get_appointment_selects('/appointments/', {'fields': 'id,description', 'cursor': ''})
+        self.assertEqual(response.data['results'][0], {'id': self.appointments[0].id, 'description': 'Long description'})
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn('JOIN', selects[0])
+        self.assertNotIn('"visit_type"', selects[0])
+        response = self.client.get('/appointments/', {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_calendar_fields_skip_unused_joins(self):
+        params = {'date__gt': '2029-12-31', 'date__lt': '2030-01-05', 'fields': 'id,date,created_for'}
+        response, selects = self.get_appointment_selects('/appointments/calendar', params)
+        self.assertEqual(response.data[0], {'id': self.appointments[0].id, 'date': '2030-01-01', 'created_for': 'Mary Jones'})
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn('user_service_avatar', selects[0])
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.doctor = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user = self.doctor)
+        self.appointment = Appointment.objects.create(
+            date = datetime.date.today(),
+            time = datetime.time(23, 59),
+            visit_type = 'I',
+            created_for = self.doctor
+        )
+
+    def assertNotModified(self, url, params = None):
+        etag = self.client.get(url, params)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def test_reads_answer_repeats_with_304(self):
+        for url in ('/appointments/', '/appointments/today', '/appointments/stats'):
+            self.assertNotModified(url)
+        self.doctor.is_staff = True
+        self.doctor.save()
+        self.assertNotModified('/appointments/calendar', {'date__gt': '2000-01-01', 'date__lt': '2000-02-01'})
+
+    def test_writes_change_the_etag(self):
+        etag = self.assertNotModified('/appointments/')
+        with self.captureOnCommitCallbacks(execute = True):
+            self.client.post(f'/appointments/{self.appointment.id}/notes/', {'description': 'note'})
+        response = self.client.get('/appointments/', HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['note_count'], 1)
+        etag = self.assertNotModified('/appointments/today')
+        with self.captureOnCommitCallbacks(execute = True):
+            self.client.post('/appointments/bulk-update/', {'ids': [self.appointment.id], 'is_closed': True}, format = 'json')
+        self.assertEqual(self.client.get('/appointments/today', HTTP_IF_NONE_MATCH = etag).status_code, 200)
+
+    def test_lost_versions_are_not_handed_out_again(self):
+        etag = self.assertNotModified('/appointments/today')
+        with self.captureOnCommitCallbacks(execute = True):
+            self.client.post('/appointments/bulk-update/', {'ids': [self.appointment.id], 'is_closed': True}, format = 'json')
+        #e.g. a restart of the cache server
+        cache.delete(get_version_key(self.doctor.id))
+        self.assertEqual(self.client.get('/appointments/today', HTTP_IF_NONE_MATCH = etag).status_code, 200)
+
+    def test_etags_are_per_user(self):
+        etag = self.client.get('/appointments/')['ETag']
+        other = User.objects.create_user(
+            username = 'other',
+            email = 'other@example.com',
+            password = 'password'
+        )
+        self.client.force_authenticate(user = other)
+        self.assertEqual(self.client.get('/appointments/', HTTP_IF_NONE_MATCH = etag).status_code, 200)
+
+class AsyncReadViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(
+            username = 'admin',
+            email = 'admin@example.com',
+            password = 'password',
+            is_staff = True
+        )
+        self.doctor = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password'
+        )
+        today = datetime.date.today()
+        for day in range(3):
+            Appointment.objects.create(
+                date = today + datetime.timedelta(days = day),
+                time = datetime.time(23, 59),
+                visit_type = 'I',
+                created_for = self.doctor
+            )
+        self.factory = AsyncRequestFactory()
+        self.calendar_params = {
+            'date__gt': today - datetime.timedelta(days = 1),
+            'date__lt': today + datetime.timedelta(days = 3)
+        }
+
+    def get_async(self, view, path, params = None, user = None, headers = None):
+        headers = dict(headers or {})
+        if user is not None:
+            headers['Authorization'] = f'JWT {AccessToken.for_user(user)}'
+        return async_to_sync(view)(self.factory.get(path, params, headers = headers))
+
+    def get_sync(self, path, params = None, user = None):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION = f'JWT {AccessToken.for_user(user)}')
+        return client.get(path, params)
+
+    def test_async_views_match_sync_views(self):
+        for view, path, params, user in (
+            (async_views.dashboard, '/appointments/stats', None, self.doctor),
+            (async_views.get_todays_appointments, '/appointments/today', None, self.doctor),
+            (async_views.calendar, '/appointments/calendar', self.calendar_params, self.staff),
+            (async_views.calendar, '/appointments/calendar', {**self.calendar_params, 'cursor': '', 'page_size': 2}, self.staff)
+        ):
+            expected = self.get_sync(path, params, user)
+            response = self.get_async(view, path, params, user)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content), json.loads(expected.content))
+            self.assertEqual(response['ETag'], expected['ETag'])
+            repeat = self.get_async(view, path, params, user, headers = {'If-None-Match': response['ETag']})
+            self.assertEqual(repeat.status_code, 304)
+
+    def test_async_views_reject_like_sync_views(self):
+        response = self.get_async(async_views.dashboard, '/appointments/stats')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.content), {'user': ['Invalid user.']})
+        response = self.get_async(async_views.calendar, '/appointments/calendar', headers = {'Authorization': 'JWT invalid'})
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('WWW-Authenticate', response)
+        response = self.get_async(async_views.calendar, '/appointments/calendar', self.calendar_params, self.doctor)
+        self.assertEqual(response.status_code, 403)
+        response = self.get_async(async_views.calendar, '/appointments/calendar', user = self.staff)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date__gt', json.loads(response.content))
+
+class SharedCacheCheckTests(TestCase):
+    def test_local_cache_warns_without_debug(self):
+        local = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379'}}
+        with override_settings(DEBUG = False, CACHES = local):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ['appointments_service.W001'])
+        with override_settings(DEBUG = True, CACHES = local):
+            self.assertEqual(check_shared_cache(None), [])
+        with override_settings(DEBUG = False, CACHES = shared):
+            self.assertEqual(check_shared_cache(None), [])
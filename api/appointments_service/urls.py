@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework_nested import routers
-from .views import AppointmentViewSet, NoteViewSet, dashboard, CalendarView, get_todays_appointments
+from . import async_views
+from .views import AppointmentViewSet, NoteViewSet, dashboard, CalendarView, CalendarDensityView, get_todays_appointments, availability
 
 #route for /appointments/
 router = routers.DefaultRouter()
@@ -18,10 +20,19 @@ appointment_router.register(
     basename = 'appointment-note'
 )
 
+#the hot read endpoints, served by the async views when ASYNC_READ_VIEWS is set
+if settings.ASYNC_READ_VIEWS:
+    read_views = (async_views.calendar, async_views.dashboard, async_views.get_todays_appointments)
+else:
+    read_views = (CalendarView.as_view(), dashboard, get_todays_appointments)
+calendar_view, dashboard_view, today_view = read_views
+
 urlpatterns = [
     path('', include(router.urls)),
     path('', include(appointment_router.urls)),
-    path('calendar', CalendarView.as_view()),
-    path('stats', dashboard),
-    path('today', get_todays_appointments)
+    path('calendar', calendar_view, name = 'calendar'),
+    path('calendar/density', CalendarDensityView.as_view(), name = 'calendar-density'),
+    path('stats', dashboard_view),
+    path('today', today_view),
+    path('availability', availability)
 ]
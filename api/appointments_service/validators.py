@@ -1,19 +1,67 @@
+from contextlib import contextmanager
+from django.db import IntegrityError, transaction
 from rest_framework.validators import ValidationError
 from .models import Appointment
 
-def validate_appointment_time(validated_data, id):
-    #check if the slot is already taken
-    create_date = validated_data["date"]
-    create_time = validated_data["time"]
+SLOT_CONSTRAINT = 'unique_appointment_user_date_hour'
+
+def get_conflicting_slots(created_for, date, id):
     exisiting_appointments = Appointment.objects\
-                            .filter(date = create_date, created_for = validated_data['created_for'])
+                            .filter(date = date, created_for = created_for)
     if id:
         exisiting_appointments = exisiting_appointments.exclude(pk=id)
-    existing_appointment_times = exisiting_appointments.values_list('time', flat=True)
-    conflicting_slots = [
-        time_obj.strftime('%I %p') for time_obj in existing_appointment_times
+    return [
+        time_obj.strftime('%I %p') for time_obj in exisiting_appointments.values_list('time', flat=True)
     ]
-    if any(time_obj.hour == create_time.hour for time_obj in existing_appointment_times):
+
+@contextmanager
+def validate_appointment_time(appointment):
+    '''
+        Wraps the save of an appointment, the hour slot is enforced by
+        the unique_appointment_user_date_hour constraint and a violation
+        is reported back as the conflicting slots of that day
+    '''
+    try:
+        with transaction.atomic():
+            yield
+    except IntegrityError as error:
+        if SLOT_CONSTRAINT not in str(error):
+            raise
         raise ValidationError({
-            "conflicting_slots": conflicting_slots
-        })
\ No newline at end of file
+            "conflicting_slots": get_conflicting_slots(
+                appointment.created_for_id,
+                appointment.date,
+                appointment.pk
+            )
+        })
+
+def get_bulk_conflicting_slots(appointments, exclude_ids = ()):
+    '''
+        Checks a batch of appointments against the existing bookings
+        with one query and against each other.
+        Bookings in exclude_ids are ignored, e.g. the old slots of moved appointments.
+        Returns one error dict per appointment, empty when the slot is free.
+    '''
+    taken = {}
+    exisiting_appointments = Appointment.objects.filter(
+                                created_for__in = {appointment.created_for_id for appointment in appointments},
+                                date__in = {appointment.date for appointment in appointments}
+                            ).exclude(
+                                pk__in = exclude_ids
+                            ).values_list('created_for', 'date', 'time')
+    for created_for, date, time in exisiting_appointments:
+        taken.setdefault((created_for, date), []).append(time)
+    
+    errors = []
+    for appointment in appointments:
+        day_times = taken.setdefault((appointment.created_for_id, appointment.date), [])
+        if any(time_obj.hour == appointment.time.hour for time_obj in day_times):
+            errors.append({
+                "conflicting_slots": [
+                    time_obj.strftime('%I %p') for time_obj in day_times
+                ]
+            })
+        else:
+            errors.append({})
+            day_times.append(appointment.time)
+    return errors
@@ -0,0 +1,84 @@
+import hashlib
+import time
+from django.core.cache import cache
+from django.db import transaction
+from user_service.conditional import is_not_modified, not_modified_response, set_etag
+from user_service.directory import get_directory_version
+
+#version of the appointments a staff user can read, bumped by every write
+ALL_USERS = 'all'
+
+def get_version_key(scope):
+    return f'appointment-data-version:{scope}'
+
+def get_data_version(scope):
+    key = get_version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        #a lost key restarts past every version handed out before it
+        seed = time.time_ns()
+        cache.add(key, seed, None)
+        version = cache.get(key, seed)
+    return version
+
+async def aget_data_version(scope):
+    key = get_version_key(scope)
+    version = await cache.aget(key)
+    if version is None:
+        seed = time.time_ns()
+        await cache.aadd(key, seed, None)
+        version = await cache.aget(key, seed)
+    return version
+
+def bump_data_version(scope):
+    key = get_version_key(scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+
+def bump_data_versions(user_ids):
+    '''
+        Moves the appointment data of the given users and of the staff
+        views to a new version once the write is committed, so no reader
+        can pair the new version with the data from before the write
+    '''
+    scopes = {*user_ids, ALL_USERS}
+    scopes.discard(None)
+    def bump():
+        for scope in scopes:
+            bump_data_version(scope)
+    transaction.on_commit(bump)
+
+def get_user_data_version(user):
+    return get_data_version(ALL_USERS if user.is_staff else user.id)
+
+async def aget_user_data_version(user):
+    return await aget_data_version(ALL_USERS if user.is_staff else user.id)
+
+def get_request_etag(request, version, *parts):
+    '''
+        Strong ETag of a read of the user at a data version, the full path
+        and any extra parts the response depends on are folded in
+    '''
+    source = '|'.join(str(part) for part in (request.user.id, version, request.get_full_path(), *parts))
+    return f'"{hashlib.sha1(source.encode()).hexdigest()}"'
+
+class ConditionalListMixin:
+    '''
+        Answers list requests with 304 Not Modified when the ETag of the
+        user's data version matches If-None-Match, before any query is run.
+        The doctor directory version is folded in as the rows show the
+        names and avatars of the users they are created for.
+    '''
+    def get_list_etag(self, request):
+        return get_request_etag(request, get_user_data_version(request.user), get_directory_version())
+
+    def list(self, request, *args, **kwargs):
+        etag = self.get_list_etag(request)
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            set_etag(response, etag)
+        return response
@@ -1,20 +1,42 @@
 import datetime
+from django.contrib.auth import get_user_model
+from django.db.models import Count, Q
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import urlencode
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import OrderingFilter
-from rest_framework.generics import ListAPIView
+from rest_framework.generics import GenericAPIView, ListAPIView
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.response import Response
-from rest_framework.status import HTTP_401_UNAUTHORIZED
+from rest_framework.status import HTTP_201_CREATED, HTTP_401_UNAUTHORIZED
+from user_service.conditional import is_not_modified, not_modified_response, set_etag
 
-from .filters import CustomAppointmentFilter, CalendarFilter
+from .access import get_appointment_access
+from .availability import find_free_slots
+from .daily_cache import get_or_build_daily
+from .fieldsets import SparseFieldsetMixin
+from .filters import CustomAppointmentFilter, CalendarFilter, CalendarStreamFilter
 from .models import Appointment, Note
-from .pagination import CustomPagination
+from .pagination import CustomPagination, KeysetPagination, NoteCursorPagination, SearchPagination
 from .permissions import IsUserAppointmentOrAdmin
-from .serializers import AppointmentSerializer, CreateAppointmentSerializer, NoteSerializer, CalendarSerializer, DailyAppointmentSerailizer
+from .search import highlight_results, search_appointments
+from .serializers import AppointmentSearchSerializer, AppointmentSerializer, AvailabilitySearchSerializer, BulkCreateAppointmentSerializer, BulkUpdateAppointmentSerializer, CreateAppointmentSerializer, NoteSerializer, CalendarSerializer, DailyAppointmentSerailizer
+from .stats import get_user_stats
+from .streaming import stream_json_list
+from .versions import ConditionalListMixin, get_data_version, get_request_etag
 
-class AppointmentViewSet(ModelViewSet):
+User = get_user_model()
+
+'''
+    Lists leave description out unless it is asked for with ?fields=,
+    the details of an appointment return every field by default.
+    Lists carry an ETag of the user's data version and answer repeats with 304.
+'''
+class AppointmentViewSet(ConditionalListMixin, SparseFieldsetMixin, ModelViewSet):
     permission_classes = [IsAuthenticated]
     filter_backends = [
         DjangoFilterBackend,
@@ -29,6 +51,13 @@ class AppointmentViewSet(ModelViewSet):
         'is_active',
     ]
     pagination_class = CustomPagination
+    fieldset_columns = {
+        'created_for_full_name': ['created_for__first_name', 'created_for__last_name'],
+        'visit_type_full': ['visit_type']
+    }
+    #the keyset pagination positions on date, time and id
+    fieldset_required_columns = ('id', 'date', 'time')
+    default_deferred_fields = ('description',)
     
     def get_queryset(self):
         user = self.request.user 
@@ -40,6 +69,12 @@ class AppointmentViewSet(ModelViewSet):
     def get_serializer_class(self, *args, **kwargs):
         if self.action == 'create':
             return CreateAppointmentSerializer
+        if self.action == 'bulk':
+            return BulkCreateAppointmentSerializer
+        if self.action == 'bulk_update':
+            return BulkUpdateAppointmentSerializer
+        if self.action == 'search':
+            return AppointmentSearchSerializer
         return AppointmentSerializer
     
     def get_serializer_context(self):
@@ -48,28 +83,89 @@ class AppointmentViewSet(ModelViewSet):
             'user': self.request.user
         }
     
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        appointments = serializer.save()
+        return Response(
+            status = HTTP_201_CREATED,
+            data = CreateAppointmentSerializer(appointments, many=True).data
+        )
+    
+    '''
+        Applies is_closed, shift_days and created_for to the appointments
+        given by ids in the body and/or the list filters in the query string.
+        Without ids at least one list filter has to be given a value,
+        other query params do not narrow the update.
+    '''
+    @action(detail=False, methods=['post'], url_path='bulk-update')
+    def bulk_update(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        filterset = self.filterset_class(request.query_params, queryset=self.get_queryset(), request=request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        filtered = any(
+            value not in (None, '', []) for value in filterset.form.cleaned_data.values()
+        )
+        if 'ids' not in serializer.validated_data and not filtered:
+            raise ValidationError({"ids": ["Provide ids or a filter."]})
+        updated = serializer.update_queryset(filterset.qs)
+        return Response(data = {'updated': updated})
+    
+    '''
+        Full text search over the descriptions of the appointments and
+        their notes, ranked best match first with highlighted headlines.
+        Scoped like the list, the list filters apply on top of q.
+    '''
+    @action(detail=False, methods=['get'], pagination_class=SearchPagination)
+    def search(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({"q": ["This field is required."]})
+        queryset = search_appointments(self.filter_queryset(self.get_queryset()), query)
+        page = self.paginate_queryset(queryset)
+        highlight_results(page, query, queryset.db)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
 class NoteViewSet(ModelViewSet):
     permission_classes = [IsAuthenticated, IsUserAppointmentOrAdmin]
     serializer_class = NoteSerializer
+    pagination_class = NoteCursorPagination
     
     def get_queryset(self):
-        user = self.request.user 
-        if user.is_staff:
-            return Note.objects.filter(appointment = self.kwargs['appointment_pk'])\
-                   .select_related('created_by__avatar', 'appointment')
-        else:
-            return Note.objects.filter(
-                appointment = self.kwargs['appointment_pk'],
-                appointment__created_for = user
-            ).select_related('created_by__avatar', 'appointment')
+        #access to the appointment is checked once by IsUserAppointmentOrAdmin
+        return Note.objects.filter(appointment = self.kwargs['appointment_pk'])\
+               .select_related('created_by__avatar')
     
     def get_serializer_context(self):
         return {
             'request': self.request,
             'user': self.request.user,
-            'appointment_id': self.kwargs['appointment_pk']
+            'appointment_id': self.kwargs['appointment_pk'],
+            'appointment_access': get_appointment_access(self.request, self)
         }
         
+def get_dashboard_data(stats, open_times, time_now):
+    #open appointments of today whose time has passed are past due
+    t_past_due = sum(1 for time in open_times if time < time_now)
+    return {
+        'today': {
+            'total': stats['t_total'],
+            'open': stats['t_total'] - stats['t_closed'] - t_past_due,
+            'closed': stats['t_closed'],
+            'past_due': t_past_due
+        },
+        'lifetime': {
+            'total': stats['l_total'],
+            'open': stats['l_open'],
+            'closed': stats['l_closed'],
+            'past_due': stats['l_total'] - stats['l_closed'] - stats['l_open']
+        }
+    }
+
 '''
     Endpoint for user to get their stats.
     When endpoint is hit 2 stat categories are generated
@@ -77,66 +173,37 @@ class NoteViewSet(ModelViewSet):
         2> Today
     Note: the states are only date dependent and not time dependent for lifetime 
           the stats are both date and time dependent for todays stat
+          counters are read from the denormalized AppointmentStats buckets,
+          only the time dependent split of today touches the appointments table,
+          both are cached per user and day until the user's appointments change
 '''
 @api_view(['GET'])
 def dashboard(request):
     user = request.user
     if user.is_authenticated:
-        today = datetime.date.today()
-        time_now = datetime.datetime.now().time()
-        l_total_appointments = Appointment.objects.filter(
-                                created_for = user
-                            ).count()
-        l_open_appointments = Appointment.objects.filter(
-                                date__gte = today, 
-                                is_closed = False,
-                                created_for = user
-                            ).count()
-        l_closed_appointments = Appointment.objects.filter(
-                                is_closed = True,
-                                created_for = user
-                              ).count()
-        l_past_due_appointments = Appointment.objects.filter(
-                                    date__lt = today, 
-                                    is_closed = False,
-                                    created_for = user
-                                ).count()
-        t_total_appointments = Appointment.objects.filter(
-                                date = today,
-                                created_for = user
-                               ).count()
-        t_open_appointments = Appointment.objects.filter(
-                                date = today, 
-                                time__gte = time_now,
-                                is_closed = False,
-                                created_for = user
-                            ).count()
-        t_closed_appointments = Appointment.objects.filter(
+        now = datetime.datetime.now()
+        today = now.date()
+        time_now = now.time()
+        version = get_data_version(user.id)
+        #past due counts move with the clock, so the minute is part of the ETag
+        etag = get_request_etag(request, version, now.strftime('%Y-%m-%dT%H:%M'))
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+        
+        def build():
+            stats = get_user_stats(user, today)
+            open_times = []
+            if stats['t_total'] > stats['t_closed']:
+                open_times = list(Appointment.objects.filter(
+                                created_for = user,
                                 date = today,
-                                is_closed = True,
-                                created_for = user
-                              ).count()
-        t_past_due_appointments = Appointment.objects.filter(
-                                    date = today,
-                                    time__lt = time_now,
-                                    is_closed = False,
-                                    created_for = user
-                                ).count()
+                                is_closed = False
+                            ).values_list('time', flat = True))
+            return stats, open_times
         
-        return Response({
-            'today': {
-                'total': t_total_appointments,
-                'open': t_open_appointments,
-                'closed': t_closed_appointments,
-                'past_due': t_past_due_appointments
-            },
-            'lifetime': {
-                'total': l_total_appointments,
-                'open': l_open_appointments,
-                'closed': l_closed_appointments,
-                'past_due': l_past_due_appointments
-            }
-        })
+        #the day's counters and open times are cached, the clock only splits them
+        stats, open_times = get_or_build_daily('dashboard', user.id, now, version, build)
+        return set_etag(Response(get_dashboard_data(stats, open_times, time_now)), etag)
     else:
         return Response(
             status = HTTP_401_UNAUTHORIZED,
@@ -145,23 +212,184 @@ def dashboard(request):
             }
         )
         
-class CalendarView(ListAPIView):
+'''
+    Endpoint for admins to get the appointments of a date range.
+    date__gt and date__lt are required and the range is capped by
+    CalendarFilterForm.max_window_days.
+    Passing stream=true streams the rows as a JSON array from a server side
+    cursor instead of building the whole response in memory.
+    ?fields= picks the returned fields and the joins needed for them.
+    Repeats of an unchanged range are answered with 304.
+'''
+class CalendarView(ConditionalListMixin, SparseFieldsetMixin, ListAPIView):
     queryset = Appointment.objects.all()\
                 .select_related('created_for__avatar')\
                 .order_by('date', 'time')
     serializer_class = CalendarSerializer
     permission_classes = [IsAdminUser]
     filter_backends = [DjangoFilterBackend]
-    filterset_class = CalendarFilter    
+    filterset_class = CalendarFilter
+    pagination_class = KeysetPagination
+    stream_chunk_size = 500
+    fieldset_columns = {
+        'created_for': ['created_for__first_name', 'created_for__last_name'],
+        'created_for_avatar': [
+            'created_for__avatar__user_id',
+            'created_for__avatar__avatar',
+            'created_for__avatar__avatar_small'
+        ]
+    }
+    fieldset_required_columns = ('id', 'date', 'time')
+    
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('stream') in ('true', '1'):
+            #streaming takes wider date ranges than the paged list
+            filterset = CalendarStreamFilter(request.query_params, queryset = self.get_queryset(), request = request)
+            if not filterset.is_valid():
+                raise ValidationError(filterset.errors)
+            queryset = filterset.qs
+            return StreamingHttpResponse(
+                stream_json_list(self.get_serializer(), queryset, self.stream_chunk_size),
+                content_type = 'application/json'
+            )
+        return super().list(request, *args, **kwargs)
+
+'''
+    Endpoint for admins to get the number of appointments per day of a date range.
+    Takes the same filters as the calendar, passing group_by=doctor also
+    splits every day by the user the appointments were created for.
+    Every day links to the calendar rows of that day so they can be loaded lazily.
+'''
+class CalendarDensityView(GenericAPIView):
+    queryset = Appointment.objects.all()
+    permission_classes = [IsAdminUser]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = CalendarFilter
+    
+    def get(self, request, *args, **kwargs):
+        by_doctor = request.query_params.get('group_by') == 'doctor'
+        group_fields = ['date']
+        if by_doctor:
+            group_fields += [
+                'created_for',
+                'created_for__first_name',
+                'created_for__last_name'
+            ]
+        buckets = self.filter_queryset(self.get_queryset())\
+                    .values(*group_fields)\
+                    .annotate(
+                        total = Count('id'),
+                        closed = Count('id', filter = Q(is_closed = True))
+                    )\
+                    .order_by(*group_fields)
+        
+        days = {}
+        for bucket in buckets:
+            day = days.get(bucket['date'])
+            if day is None:
+                day = days[bucket['date']] = {
+                    'date': bucket['date'],
+                    'total': 0,
+                    'closed': 0,
+                    'detail': self.get_detail_url(bucket['date'])
+                }
+                if by_doctor:
+                    day['doctors'] = []
+            day['total'] += bucket['total']
+            day['closed'] += bucket['closed']
+            if by_doctor:
+                day['doctors'].append({
+                    'id': bucket['created_for'],
+                    'full_name': f"{bucket['created_for__first_name']} {bucket['created_for__last_name']}",
+                    'total': bucket['total'],
+                    'closed': bucket['closed']
+                })
+        return Response(data = list(days.values()))
+    
+    def get_detail_url(self, date):
+        params = {
+            'date__gt': date - datetime.timedelta(days = 1),
+            'date__lt': date + datetime.timedelta(days = 1)
+        }
+        created_for = self.request.query_params.get('created_for')
+        if created_for:
+            params['created_for'] = created_for
+        return self.request.build_absolute_uri(f"{reverse('calendar')}?{urlencode(params)}")
 
+'''
+    Endpoint for user to get their appointments of today,
+    cached per user and day until the user's appointments change
+'''
 @api_view(['GET'])
 def get_todays_appointments(request):
     user = request.user
     if user.is_authenticated:
-        today = datetime.date.today()
-        appointments = Appointment.objects.filter(created_for = user, date = today).order_by('time')
-        serializer = DailyAppointmentSerailizer(appointments, many = True)
-        return Response(data = serializer.data)
+        now = datetime.datetime.now()
+        today = now.date()
+        version = get_data_version(user.id)
+        etag = get_request_etag(request, version, today)
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+        
+        def build():
+            appointments = Appointment.objects.filter(created_for = user, date = today).order_by('time')
+            return DailyAppointmentSerailizer(appointments, many = True).data
+        
+        data = get_or_build_daily('today', user.id, now, version, build)
+        return set_etag(Response(data = data), etag)
+    else:
+        return Response(
+            status = HTTP_401_UNAUTHORIZED,
+            data = {
+                'user': ['Invalid user.']
+            }
+        )
+
+'''
+    Endpoint to find the first free hour slots.
+    Staff can search the given doctors or every active doctor,
+    other users only get their own openings.
+    Query params: doctor (repeatable), from_date, to_date, limit,
+    start_hour and end_hour
+'''
+@api_view(['GET'])
+def availability(request):
+    user = request.user
+    if user.is_authenticated:
+        serializer = AvailabilitySearchSerializer(data = {
+            **request.query_params.dict(),
+            'doctor': request.query_params.getlist('doctor')
+        })
+        serializer.is_valid(raise_exception = True)
+        search = serializer.validated_data
+        
+        if user.is_staff:
+            doctors = User.objects.filter(is_active = True)
+            if search.get('doctor'):
+                doctors = doctors.filter(id__in = search['doctor'])
+            else:
+                doctors = doctors.filter(is_staff = False)
+        else:
+            doctors = User.objects.filter(id = user.id)
+        doctors = {
+            doctor.id: doctor for doctor in doctors.only('id', 'first_name', 'last_name')
+        }
+        
+        openings = find_free_slots(
+            doctors.keys(),
+            search['from_date'],
+            search['to_date'],
+            search['limit'],
+            hours = range(search['start_hour'], search['end_hour'])
+        )
+        return Response(data = [
+            {
+                'date': date,
+                'time': time,
+                'created_for': user_id,
+                'created_for_full_name': str(doctors[user_id])
+            } for date, time, user_id in openings
+        ])
     else:
         return Response(
             status = HTTP_401_UNAUTHORIZED,
@@ -0,0 +1,102 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+USER_CACHE_TIMEOUT = 60
+#never copied into the cache, loaded from the db if a request needs it
+UNCACHED_USER_FIELDS = ('password',)
+
+def get_user_cache_key(token_id):
+    return f'jwt-user:{token_id}'
+
+def get_user_version_key(user_id):
+    return f'jwt-user-version:{user_id}'
+
+def bump_user_version(user_id):
+    key = get_user_version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+def invalidate_cached_user(user_id):
+    '''
+        Drops the cached user of every token of the user once the write
+        is committed, so no request can cache the row from before it
+    '''
+    transaction.on_commit(lambda: bump_user_version(user_id))
+
+class CachedJWTAuthentication(JWTAuthentication):
+    '''
+        JWTAuthentication keeping the resolved user for USER_CACHE_TIMEOUT
+        seconds keyed by the token id.
+        Entries carry the version of the user, which is bumped by every save
+        and delete of the user, so edits and deactivations apply at once.
+        Cached users are rebuilt with the uncached fields deferred.
+    '''
+    def get_cache_keys(self, validated_token):
+        token_id = validated_token.get(api_settings.JTI_CLAIM)
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if token_id is None or user_id is None:
+            return None
+        return get_user_cache_key(token_id), get_user_version_key(user_id)
+
+    def read_cached_user(self, keys, cached):
+        '''
+            Returns the cached user, or None when it is missing or stale,
+            and the current version of the user
+        '''
+        key, version_key = keys
+        version = cached.get(version_key, 0)
+        entry = cached.get(key)
+        if entry is None or entry['version'] != version:
+            return None, version
+        fields = entry['fields']
+        return self.user_model.from_db(DEFAULT_DB_ALIAS, list(fields), list(fields.values())), version
+
+    def get_cache_entry(self, user, version):
+        return {
+            'version': version,
+            'fields': {
+                field.attname: getattr(user, field.attname)
+                for field in self.user_model._meta.concrete_fields
+                if field.attname not in UNCACHED_USER_FIELDS
+            }
+        }
+
+    def get_user(self, validated_token):
+        keys = self.get_cache_keys(validated_token)
+        if keys is None:
+            return super().get_user(validated_token)
+        user, version = self.read_cached_user(keys, cache.get_many(keys))
+        if user is None:
+            user = super().get_user(validated_token)
+            cache.set(keys[0], self.get_cache_entry(user, version), USER_CACHE_TIMEOUT)
+        return user
+
+    async def aauthenticate(self, request):
+        '''
+            authenticate for async views, the cache and the user table
+            are read through their async APIs so the event loop is never blocked
+        '''
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        load_user = sync_to_async(super().get_user)
+        keys = self.get_cache_keys(validated_token)
+        if keys is None:
+            return await load_user(validated_token)
+        user, version = self.read_cached_user(keys, await cache.aget_many(keys))
+        if user is None:
+            user = await load_user(validated_token)
+            await cache.aset(keys[0], self.get_cache_entry(user, version), USER_CACHE_TIMEOUT)
+        return user
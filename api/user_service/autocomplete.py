@@ -0,0 +1,127 @@
+from bisect import bisect_left, insort
+from threading import Lock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from .models import normalize_name
+
+#fields a user can be found by, any other field change leaves the index alone
+INDEXED_FIELDS = ('username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff')
+INDEX_VERSION_KEY = 'user-prefix-index-version'
+
+def get_terms(user):
+    '''
+        Returns the lower cased prefixes a user can be found by,
+        the username, the email and every word of the names
+    '''
+    terms = {user['username'].casefold(), user['email'].casefold()}
+    terms.update(normalize_name(user['first_name'], user['last_name']).split())
+    terms.discard('')
+    return terms
+
+class UserPrefixIndex:
+    '''
+        In-process sorted list of (term, user id) pairs searched with bisect.
+        It is built lazily on the first search and kept current by the
+        User post_save and post_delete handlers of this process.
+        Writes bump a version in the shared cache so other processes
+        rebuild their copy on their next search.
+    '''
+    def __init__(self):
+        self.lock = Lock()
+        self.clear()
+
+    def clear(self):
+        self.entries = None
+        self.users = {}
+        self.version = None
+
+    def get_version(self):
+        return cache.get(INDEX_VERSION_KEY, 0)
+
+    def bump_version(self):
+        try:
+            return cache.incr(INDEX_VERSION_KEY)
+        except ValueError:
+            cache.add(INDEX_VERSION_KEY, 1)
+            return cache.get(INDEX_VERSION_KEY, 1)
+
+    def build(self, version):
+        users = get_user_model().objects.values('id', *INDEXED_FIELDS)
+        self.users = {user['id']: user for user in users.iterator()}
+        self.entries = sorted(
+            (term, user_id)
+            for user_id, user in self.users.items()
+            for term in get_terms(user)
+        )
+        self.version = version
+
+    def ensure_built(self):
+        version = self.get_version()
+        if self.entries is None or self.version != version:
+            self.build(version)
+
+    def add(self, user):
+        self.users[user['id']] = user
+        for term in get_terms(user):
+            insort(self.entries, (term, user['id']))
+
+    def discard(self, user_id):
+        user = self.users.pop(user_id, None)
+        if user is None:
+            return
+        for term in get_terms(user):
+            position = bisect_left(self.entries, (term, user_id))
+            if position < len(self.entries) and self.entries[position] == (term, user_id):
+                del self.entries[position]
+
+    def update_user(self, user):
+        with self.lock:
+            self.apply(lambda: (self.discard(user['id']), self.add(user)))
+
+    def remove_user(self, user_id):
+        with self.lock:
+            self.apply(lambda: self.discard(user_id))
+
+    def apply(self, change):
+        #other processes learn about the write from the version alone
+        up_to_date = self.entries is not None and self.version == self.get_version()
+        version = self.bump_version()
+        if up_to_date:
+            change()
+            self.version = version
+        else:
+            self.entries = None
+
+    def search(self, query, limit, doctors_only = False):
+        '''
+            Returns up to limit users having a term starting with every
+            word of the query, in the order of their best matching term
+        '''
+        words = normalize_name(query).split()
+        if not words:
+            return []
+        first, rest = words[0], words[1:]
+        results = []
+        seen = set()
+        with self.lock:
+            self.ensure_built()
+            position = bisect_left(self.entries, (first,))
+            while position < len(self.entries) and len(results) < limit:
+                term, user_id = self.entries[position]
+                if not term.startswith(first):
+                    break
+                position += 1
+                if user_id in seen:
+                    continue
+                seen.add(user_id)
+                user = self.users[user_id]
+                if doctors_only and (user['is_staff'] or not user['is_active']):
+                    continue
+                if rest:
+                    terms = get_terms(user)
+                    if not all(any(t.startswith(word) for t in terms) for word in rest):
+                        continue
+                results.append(user)
+        return results
+
+user_index = UserPrefixIndex()
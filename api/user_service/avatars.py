@@ -0,0 +1,70 @@
+from collections import OrderedDict
+from threading import Lock
+from django.core.cache import cache
+
+AVATAR_URL_CACHE_TIMEOUT = 24 * 60 * 60
+
+class LRUCache:
+    '''
+        Small thread safe in-process LRU used in front of the shared cache
+    '''
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+local_avatar_urls = LRUCache(max_size=1024)
+
+def get_avatar_url_key(user_id, name):
+    return f'avatar-url:{user_id}:{name}'
+
+def get_avatar_url(user_id, avatar):
+    '''
+        Returns the storage url of an avatar file, resolved once per
+        user and file name and then served from the in-process LRU
+        or the shared cache
+    '''
+    if not avatar:
+        return None
+    key = get_avatar_url_key(user_id, avatar.name)
+    url = local_avatar_urls.get(key)
+    if url is None:
+        url = cache.get(key)
+        if url is None:
+            url = avatar.url
+            cache.set(key, url, AVATAR_URL_CACHE_TIMEOUT)
+        local_avatar_urls.set(key, url)
+    return url
+
+def get_avatar_thumbnail_url(avatar, size):
+    '''
+        Returns the url of a generated thumbnail size of the avatar,
+        falling back to the original until the thumbnail is ready
+    '''
+    thumbnail = getattr(avatar, f'avatar_{size}')
+    return get_avatar_url(avatar.user_id, thumbnail or avatar.avatar)
+
+def invalidate_avatar_url(user_id, name):
+    if not name:
+        return
+    key = get_avatar_url_key(user_id, name)
+    local_avatar_urls.delete(key)
+    cache.delete(key)
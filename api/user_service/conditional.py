@@ -0,0 +1,22 @@
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+from rest_framework.status import HTTP_304_NOT_MODIFIED
+
+'''
+    Conditional GET helpers shared by the versioned read endpoints
+    of both apps
+'''
+
+def is_not_modified(request, etag):
+    return etag in [tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))]
+
+def not_modified_response(etag):
+    response = Response(status = HTTP_304_NOT_MODIFIED)
+    return set_etag(response, etag)
+
+def set_etag(response, etag):
+    response['ETag'] = etag
+    #browsers keep the response but revalidate it on every use
+    patch_cache_control(response, private = True, no_cache = True)
+    return response
@@ -0,0 +1,81 @@
+import time
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from .avatars import get_avatar_thumbnail_url
+
+DIRECTORY_VERSION_KEY = 'doctor-directory-version'
+DIRECTORY_CACHE_TIMEOUT = 60 * 60
+#user fields shown in the directory, saves touching only other fields keep the snapshot
+DIRECTORY_FIELDS = ('first_name', 'last_name', 'is_active', 'is_staff')
+
+def get_directory_version():
+    version = cache.get(DIRECTORY_VERSION_KEY)
+    if version is None:
+        #a lost key restarts past every version handed out before it
+        seed = time.time_ns()
+        cache.add(DIRECTORY_VERSION_KEY, seed, None)
+        version = cache.get(DIRECTORY_VERSION_KEY, seed)
+    return version
+
+async def aget_directory_version():
+    version = await cache.aget(DIRECTORY_VERSION_KEY)
+    if version is None:
+        seed = time.time_ns()
+        await cache.aadd(DIRECTORY_VERSION_KEY, seed, None)
+        version = await cache.aget(DIRECTORY_VERSION_KEY, seed)
+    return version
+
+def bump_directory_version():
+    try:
+        cache.incr(DIRECTORY_VERSION_KEY)
+    except ValueError:
+        cache.add(DIRECTORY_VERSION_KEY, time.time_ns(), None)
+
+def invalidate_doctor_directory():
+    '''
+        Moves the directory to a new version once the write is committed,
+        so no request can cache the snapshot of uncommitted data
+    '''
+    transaction.on_commit(bump_directory_version)
+
+def build_doctor_directory():
+    doctors = get_user_model().objects.filter(
+                is_active = True,
+                is_staff = False
+            ).select_related(
+                'avatar'
+            ).only(
+                'id',
+                'first_name',
+                'last_name',
+                'avatar__user_id',
+                'avatar__avatar',
+                'avatar__avatar_small'
+            ).order_by('first_name', 'last_name', 'id')
+    directory = []
+    for doctor in doctors:
+        try:
+            avatar = get_avatar_thumbnail_url(doctor.avatar, 'small')
+        except AttributeError:
+            avatar = None
+        directory.append({
+            'id': doctor.id,
+            'first_name': doctor.first_name,
+            'last_name': doctor.last_name,
+            'avatar': avatar
+        })
+    return directory
+
+def get_doctor_directory():
+    '''
+        Returns the current version and the snapshot of the active doctors,
+        built once per version and shared through the cache
+    '''
+    version = get_directory_version()
+    key = f'doctor-directory:{version}'
+    directory = cache.get(key)
+    if directory is None:
+        directory = build_doctor_directory()
+        cache.set(key, directory, DIRECTORY_CACHE_TIMEOUT)
+    return version, directory
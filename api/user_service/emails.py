@@ -0,0 +1,37 @@
+import functools
+import os
+from django.conf import settings
+from django.core.mail import EmailMessage
+from djoser import email
+from .outbox import OutboxEmailBackend
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'email_templates')
+
+class OutboxEmailMixin:
+    '''
+        Queues a djoser email in the outbox instead of sending it
+        while the request waits
+    '''
+    def get_connection(self, fail_silently = False):
+        return OutboxEmailBackend(fail_silently = fail_silently)
+
+class PasswordResetEmail(OutboxEmailMixin, email.PasswordResetEmail):
+    pass
+
+@functools.lru_cache
+def get_email_template(name):
+    with open(os.path.join(TEMPLATE_DIR, name), 'r') as file:
+        return file.read()
+
+def send_welcome_email(user):
+    html_content = get_email_template('welcome.html')\
+                    .replace('{{username}}', user.username)\
+                    .replace('{{site_name}}', settings.SITE_NAME)
+    message = EmailMessage(
+        f'Welcome to {settings.SITE_NAME}',
+        html_content,
+        to = [user.email],
+        connection = OutboxEmailBackend()
+    )
+    message.content_subtype = 'html'
+    message.send()
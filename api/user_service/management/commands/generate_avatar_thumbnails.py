@@ -0,0 +1,45 @@
+import time
+from django.core.management.base import BaseCommand
+from user_service.thumbnails import THUMBNAIL_BATCH_SIZE, generate_due_thumbnails
+
+class Command(BaseCommand):
+    help = 'Generates the thumbnails of uploaded avatars in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type = int,
+            default = THUMBNAIL_BATCH_SIZE,
+            help = 'Number of avatars claimed per batch.'
+        )
+        parser.add_argument(
+            '--loop',
+            action = 'store_true',
+            help = 'Keep polling for due thumbnails instead of exiting once none are left.'
+        )
+        parser.add_argument(
+            '--interval',
+            type = float,
+            default = 5,
+            help = 'Seconds to wait between polls with --loop when no thumbnails are due.'
+        )
+
+    def handle(self, *args, **options):
+        total_generated = total_failed = 0
+        try:
+            while True:
+                claimed, generated, failed = generate_due_thumbnails(options['batch_size'])
+                total_generated += generated
+                total_failed += failed
+                if claimed:
+                    self.stdout.write(f'Generated thumbnails for {generated} of {claimed} avatars.')
+                #a full batch means more avatars may be due already
+                if claimed < options['batch_size']:
+                    if not options['loop']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated thumbnails for {total_generated} avatars, {total_failed} failed attempts.'
+        ))
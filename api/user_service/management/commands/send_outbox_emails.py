@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand
+from user_service.outbox import OUTBOX_BATCH_SIZE, send_outbox_batch
+
+class Command(BaseCommand):
+    help = 'Sends the queued outbox emails in batches over one connection per batch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type = int,
+            default = OUTBOX_BATCH_SIZE,
+            help = 'Number of emails claimed and sent per connection.'
+        )
+        parser.add_argument(
+            '--loop',
+            action = 'store_true',
+            help = 'Keep polling the outbox instead of exiting once it is drained.'
+        )
+        parser.add_argument(
+            '--interval',
+            type = float,
+            default = 5,
+            help = 'Seconds to wait between polls of a drained outbox with --loop.'
+        )
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        try:
+            while True:
+                claimed, sent, failed = send_outbox_batch(options['batch_size'])
+                total_sent += sent
+                total_failed += failed
+                if claimed:
+                    self.stdout.write(f'Sent {sent} of {claimed} emails.')
+                #a full batch means more emails may be due already
+                if claimed < options['batch_size']:
+                    if not options['loop']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Sent {total_sent} emails, {total_failed} failed attempts.'))
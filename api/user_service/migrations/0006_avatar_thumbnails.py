@@ -0,0 +1,22 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("user_service", "0005_alter_avatar_user"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="avatar",
+            name="avatar_medium",
+            field=models.ImageField(blank=True, null=True, upload_to="media/"),
+        ),
+        migrations.AddField(
+            model_name="avatar",
+            name="avatar_small",
+            field=models.ImageField(blank=True, null=True, upload_to="media/"),
+        ),
+    ]
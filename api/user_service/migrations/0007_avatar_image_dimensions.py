@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:59
+
+import user_service.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("user_service", "0006_avatar_thumbnails"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="avatar",
+            name="avatar",
+            field=models.ImageField(
+                blank=True,
+                null=True,
+                upload_to="media/",
+                validators=[
+                    user_service.validators.validate_file_size,
+                    user_service.validators.validate_image_dimensions,
+                ],
+            ),
+        ),
+    ]
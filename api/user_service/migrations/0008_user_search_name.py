@@ -0,0 +1,50 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:11
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+def normalize_name(*parts):
+    return " ".join(" ".join(parts).split()).casefold()
+
+
+def populate_search_name(apps, schema_editor):
+    User = apps.get_model("user_service", "User")
+    users = []
+    for user in User.objects.only("id", "first_name", "last_name").iterator():
+        user.search_name = normalize_name(user.first_name, user.last_name)
+        users.append(user)
+    User.objects.bulk_update(users, ["search_name"], batch_size=1000)
+
+
+def create_search_name_index(apps, schema_editor):
+    # the trigram index serves the LIKE '%name%' filters on PostgreSQL
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "CREATE INDEX user_search_name_trgm_idx ON user_service_user "
+        "USING gin (search_name gin_trgm_ops)"
+    )
+
+
+def drop_search_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX user_search_name_trgm_idx")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("user_service", "0007_avatar_image_dimensions"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name="user",
+            name="search_name",
+            field=models.CharField(default="", editable=False, max_length=301),
+        ),
+        migrations.RunPython(populate_search_name, migrations.RunPython.noop),
+        migrations.RunPython(create_search_name_index, drop_search_name_index),
+    ]
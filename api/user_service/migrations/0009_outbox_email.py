@@ -0,0 +1,58 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:39
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("user_service", "0008_user_search_name"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxEmail",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("subject", models.CharField(max_length=998)),
+                ("body", models.TextField()),
+                ("content_subtype", models.CharField(default="plain", max_length=20)),
+                ("html_body", models.TextField(blank=True, default="")),
+                ("from_email", models.CharField(max_length=254)),
+                ("to", models.JSONField(default=list)),
+                ("cc", models.JSONField(default=list)),
+                ("bcc", models.JSONField(default=list)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("P", "Pending"), ("S", "Sent"), ("F", "Failed")],
+                        default="P",
+                        max_length=1,
+                    ),
+                ),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                (
+                    "next_attempt_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("last_error", models.TextField(blank=True, default="")),
+                ("created_on", models.DateTimeField(auto_now_add=True)),
+                ("sent_on", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["status", "next_attempt_at"], name="outbox_due_idx"
+                    )
+                ],
+            },
+        ),
+    ]
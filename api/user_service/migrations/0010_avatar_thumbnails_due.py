@@ -0,0 +1,43 @@
+# Generated by Django 5.1.4 on 2026-10-18 21:17
+
+from django.db import migrations, models
+from django.db.models import Q
+from django.utils import timezone
+
+
+def queue_missing_thumbnails(apps, schema_editor):
+    Avatar = apps.get_model("user_service", "Avatar")
+    missing = Q()
+    for field in ("avatar_small", "avatar_medium"):
+        missing |= Q(**{f"{field}__isnull": True}) | Q(**{field: ""})
+    Avatar.objects.exclude(avatar="").exclude(avatar__isnull=True).filter(missing).update(
+        thumbnails_due_at=timezone.now()
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("user_service", "0009_outbox_email"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="avatar",
+            name="thumbnail_attempts",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="avatar",
+            name="thumbnails_due_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="avatar",
+            index=models.Index(
+                condition=models.Q(("thumbnails_due_at__isnull", False)),
+                fields=["thumbnails_due_at"],
+                name="avatar_thumbnails_due_idx",
+            ),
+        ),
+        migrations.RunPython(queue_missing_thumbnails, migrations.RunPython.noop),
+    ]
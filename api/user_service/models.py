@@ -1,14 +1,36 @@
 from django.contrib.auth.models import AbstractUser
+from django.core.mail import EmailMultiAlternatives
 from django.db import models
-from .validators import validate_file_size
+from django.utils import timezone
+from .validators import validate_file_size, validate_image_dimensions
+
+def normalize_name(*parts):
+    '''
+        Lower cased full name with single spaces, the form names are
+        stored in User.search_name and searched with
+    '''
+    return ' '.join(' '.join(parts).split()).casefold()
 
 class User(AbstractUser):
     email = models.EmailField(unique = True)
     is_already_activated = models.BooleanField(default = False)
+    #normalized "first last" name, trigram indexed on PostgreSQL
+    search_name = models.CharField(
+        max_length = 301,
+        default = '',
+        editable = False
+    )
     
     def __str__(self):
         return f'{self.first_name} {self.last_name}'
     
+    def save(self, *args, **kwargs):
+        self.search_name = normalize_name(self.first_name, self.last_name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'first_name', 'last_name'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'search_name'}
+        super().save(*args, **kwargs)
+    
 class Avatar(models.Model):
     user = models.OneToOneField(
         User,
@@ -21,6 +43,90 @@ class Avatar(models.Model):
         null=True,
         blank=True,
         validators=[
-            validate_file_size
+            validate_file_size,
+            validate_image_dimensions
+        ]
+    )
+    #generated from avatar by the generate_avatar_thumbnails worker
+    avatar_small = models.ImageField(
+        upload_to='media/',
+        null=True,
+        blank=True
+    )
+    avatar_medium = models.ImageField(
+        upload_to='media/',
+        null=True,
+        blank=True
+    )
+    #set while the thumbnails are due, the generate_avatar_thumbnails worker
+    #picks the avatar up once it has passed, claims and retries move it forward
+    thumbnails_due_at = models.DateTimeField(null=True, blank=True)
+    thumbnail_attempts = models.PositiveSmallIntegerField(default=0)
+    
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['thumbnails_due_at'],
+                condition=models.Q(thumbnails_due_at__isnull=False),
+                name='avatar_thumbnails_due_idx'
+            )
+        ]
+
+class OutboxEmail(models.Model):
+    '''
+        Email written in the transaction of the change that triggers it
+        and delivered by the send_outbox_emails worker
+    '''
+    STATUS_PENDING = 'P'
+    STATUS_SENT = 'S'
+    STATUS_FAILED = 'F'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed')
+    ]
+    
+    subject = models.CharField(max_length = 998)
+    body = models.TextField()
+    #plain or html, the subtype of body
+    content_subtype = models.CharField(max_length = 20, default = 'plain')
+    #html alternative of a plain body
+    html_body = models.TextField(blank = True, default = '')
+    from_email = models.CharField(max_length = 254)
+    to = models.JSONField(default = list)
+    cc = models.JSONField(default = list)
+    bcc = models.JSONField(default = list)
+    status = models.CharField(
+        max_length = 1,
+        choices = STATUS_CHOICES,
+        default = STATUS_PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default = 0)
+    #pending emails are sent once this has passed, claims and retries move it forward
+    next_attempt_at = models.DateTimeField(default = timezone.now)
+    last_error = models.TextField(blank = True, default = '')
+    created_on = models.DateTimeField(auto_now_add = True)
+    sent_on = models.DateTimeField(null = True, blank = True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields = ['status', 'next_attempt_at'], name = 'outbox_due_idx')
         ]
-    )
\ No newline at end of file
+    
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)}"
+    
+    def to_message(self, connection = None):
+        message = EmailMultiAlternatives(
+            self.subject,
+            self.body,
+            self.from_email,
+            self.to,
+            cc = self.cc,
+            bcc = self.bcc,
+            connection = connection
+        )
+        message.content_subtype = self.content_subtype
+        if self.html_body:
+            message.attach_alternative(self.html_body, 'text/html')
+        return message
@@ -0,0 +1,121 @@
+import datetime
+import logging
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 6
+#first retry delay, doubled by every further failed attempt
+OUTBOX_RETRY_DELAY = datetime.timedelta(minutes = 1)
+OUTBOX_MAX_RETRY_DELAY = datetime.timedelta(hours = 1)
+#claimed emails are not picked up by another worker for this long
+OUTBOX_CLAIM_TIMEOUT = datetime.timedelta(minutes = 5)
+
+def enqueue_message(message):
+    return OutboxEmail.objects.create(
+        subject = message.subject,
+        body = message.body,
+        content_subtype = message.content_subtype,
+        html_body = next(
+            (content for content, mimetype in getattr(message, 'alternatives', []) if mimetype == 'text/html'),
+            ''
+        ),
+        from_email = message.from_email or settings.DEFAULT_FROM_EMAIL,
+        to = list(message.to),
+        cc = list(message.cc),
+        bcc = list(message.bcc)
+    )
+
+class OutboxEmailBackend(BaseEmailBackend):
+    '''
+        Email backend writing messages to the outbox instead of sending them,
+        they are committed or rolled back with the surrounding transaction
+    '''
+    def send_messages(self, email_messages):
+        with transaction.atomic():
+            for message in email_messages:
+                enqueue_message(message)
+        return len(email_messages)
+
+def get_retry_delay(attempts):
+    return min(OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), OUTBOX_MAX_RETRY_DELAY)
+
+def claim_outbox_emails(batch_size, now):
+    '''
+        Moves the next attempt of a batch of due emails past the claim
+        timeout, so concurrent workers skip them while they are sent
+        and a crashed worker's batch is retried once the claim expires
+    '''
+    with transaction.atomic():
+        ids = list(OutboxEmail.objects.filter(
+                    status = OutboxEmail.STATUS_PENDING,
+                    next_attempt_at__lte = now
+                ).order_by(
+                    'next_attempt_at'
+                ).select_for_update(
+                    skip_locked = True
+                ).values_list('id', flat = True)[:batch_size])
+        OutboxEmail.objects.filter(id__in = ids).update(next_attempt_at = now + OUTBOX_CLAIM_TIMEOUT)
+    return list(OutboxEmail.objects.filter(id__in = ids).order_by('id'))
+
+def record_failure(email, error, now):
+    email.attempts += 1
+    email.last_error = f'{type(error).__name__}: {error}'
+    if email.attempts >= OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.STATUS_FAILED
+        logger.error('Giving up on outbox email %s after %s attempts: %s', email.id, email.attempts, email.last_error)
+    else:
+        email.next_attempt_at = now + get_retry_delay(email.attempts)
+    email.save(update_fields = ['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+def send_outbox_batch(batch_size = OUTBOX_BATCH_SIZE, connection = None):
+    '''
+        Sends a batch of due emails over one connection of EMAIL_BACKEND.
+        Failed emails are retried with exponential backoff and marked
+        failed after OUTBOX_MAX_ATTEMPTS.
+        Returns the number of claimed emails, sent emails and failed attempts.
+    '''
+    now = timezone.now()
+    emails = claim_outbox_emails(batch_size, now)
+    if not emails:
+        return 0, 0, 0
+    connection = connection or get_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        for email in emails:
+            record_failure(email, error, now)
+        return len(emails), 0, len(emails)
+    sent = failed = 0
+    try:
+        for email in emails:
+            try:
+                email.to_message(connection).send()
+            except Exception as error:
+                failed += 1
+                record_failure(email, error, now)
+                #the session may be broken, later emails get a new one
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    logger.exception('Could not reopen the email connection')
+            else:
+                sent += 1
+                #marked one by one so a crash can not resend the delivered part of the batch
+                OutboxEmail.objects.filter(id = email.id).update(
+                    status = OutboxEmail.STATUS_SENT,
+                    sent_on = timezone.now(),
+                    attempts = F('attempts') + 1,
+                    last_error = ''
+                )
+    finally:
+        connection.close()
+    return len(emails), sent, failed
@@ -1,4 +1,20 @@
 from rest_framework.pagination import PageNumberPagination
 
 class CustomPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+class DirectoryPagination(PageNumberPagination):
+    '''
+        Opt in pagination of the doctor directory, used when the request
+        carries the page or page_size query param so dropdowns loading
+        the whole list keep working
+    '''
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_query_param not in request.query_params \
+                and self.page_size_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
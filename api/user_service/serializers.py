@@ -1,10 +1,19 @@
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password
+from django.db import models
 from django.utils.crypto import get_random_string
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from .avatars import get_avatar_url, invalidate_avatar_url
 from .models import Avatar
+from .thumbnails import clear_avatar_thumbnails, schedule_avatar_thumbnails
+
+class CachedAvatarField(serializers.ImageField):
+    def to_representation(self, value):
+        if not value:
+            return None
+        return get_avatar_url(value.instance.user_id, value)
 
 class CustomUserCreateSerializer(UserCreateSerializer):
     class Meta(UserCreateSerializer.Meta):
@@ -41,11 +50,22 @@ class CustomUserCreateSerializer(UserCreateSerializer):
         return user
     
 class AvatarSerializer(serializers.ModelSerializer):
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.ImageField: CachedAvatarField
+    }
+    
     class Meta():
         model = Avatar
         fields = [
             'user_id',
-            'avatar'
+            'avatar',
+            'avatar_small',
+            'avatar_medium'
+        ]
+        read_only_fields = [
+            'avatar_small',
+            'avatar_medium'
         ]
         
     def create(self, validated_data):
@@ -54,13 +74,20 @@ class AvatarSerializer(serializers.ModelSerializer):
             raise ValidationError({"error": "An avatar already exists for this user."})
         avatar = Avatar(**validated_data)
         avatar.user_id = user_id
+        schedule_avatar_thumbnails(avatar)
         avatar.save()
+        invalidate_avatar_url(avatar.user_id, avatar.avatar.name)
         return avatar
     
     def update(self, instance: Avatar, validated_data):
+        old_name = instance.avatar.name
         instance.avatar = validated_data['avatar']
         instance.user_id = self.context['user_id']
+        clear_avatar_thumbnails(instance)
+        schedule_avatar_thumbnails(instance)
         instance.save()
+        if instance.avatar.name != old_name:
+            invalidate_avatar_url(instance.user_id, old_name)
         return instance
     
 class CustomUserSerializer(UserSerializer):
@@ -1,30 +1,57 @@
-from decouple import config
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.conf import settings
-from django.core.mail import EmailMessage
-import os
+from user_service.authentication import invalidate_cached_user
+from user_service.autocomplete import INDEXED_FIELDS, user_index
+from user_service.directory import DIRECTORY_FIELDS, invalidate_doctor_directory
+from user_service.emails import send_welcome_email
+from user_service.models import Avatar
 
+#the welcome email is queued in the outbox and sent by the send_outbox_emails worker
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def user_activated_for_first_time(sender, instance, created, **kwargs):    
     if not created:
         if instance.is_active and not instance.is_already_activated:
-            #send welcome email 
-            base_dir = os.path.dirname(os.path.abspath(__file__))
-            base_dir = os.path.dirname(base_dir)
-            template_path = os.path.join(base_dir, 'email_templates', 'welcome.html')
-            with open(template_path, 'r') as file:
-                html_content = file.read()
-            
-            html_content = html_content.replace('{{username}}', instance.username)
-            html_content = html_content.replace('{{site_name}}', config('SITE_NAME'))
-            email = EmailMessage(
-                f'Welcome to {config("SITE_NAME")}',
-                html_content,
-                [instance.email],
-            )
-            email.content_subtype = "html"
-            email.send()
-            # Mark the user as already activated
+            with transaction.atomic():
+                #the flag is set without saving the user again,
+                #only the request flipping it queues the email
+                activated = sender.objects.filter(
+                    pk=instance.pk,
+                    is_already_activated=False
+                ).update(is_already_activated=True)
+                if activated:
+                    send_welcome_email(instance)
+                    invalidate_cached_user(instance.pk)
             instance.is_already_activated = True
-            instance.save(update_fields=["is_already_activated"])
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def update_user_prefix_index(sender, instance, update_fields, **kwargs):
+    #logins and activation flags only save fields the index does not use
+    if update_fields is not None and not set(update_fields) & set(INDEXED_FIELDS):
+        return
+    user = {'id': instance.pk, **{field: getattr(instance, field) for field in INDEXED_FIELDS}}
+    transaction.on_commit(lambda: user_index.update_user(user))
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def remove_user_from_prefix_index(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: user_index.remove_user(user_id))
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_directory_on_user_save(sender, instance, update_fields, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(DIRECTORY_FIELDS):
+        return
+    invalidate_doctor_directory()
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+@receiver(post_save, sender=Avatar)
+@receiver(post_delete, sender=Avatar)
+def invalidate_directory(sender, **kwargs):
+    invalidate_doctor_directory()
+
+#every save drops the user resolved for the JWTs of the user by CachedJWTAuthentication
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_authenticated_user(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
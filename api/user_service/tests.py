@@ -1,3 +1,464 @@
-from django.test import TestCase
+import datetime
+import smtplib
+import struct
+import zlib
+from io import BytesIO, StringIO
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from .autocomplete import user_index
+from .avatars import get_avatar_url, invalidate_avatar_url, local_avatar_urls
+from .directory import DIRECTORY_VERSION_KEY
+from .models import Avatar, OutboxEmail
+from .outbox import OUTBOX_MAX_ATTEMPTS, send_outbox_batch
+from .serializers import AvatarSerializer
+from .thumbnails import THUMBNAIL_MAX_ATTEMPTS, generate_avatar_thumbnails, generate_due_thumbnails, get_thumbnail_format
+from .uploads import AvatarUploadHandler, FileTooLarge
+from .validators import validate_image_dimensions
+
+User = get_user_model()
+
+class AvatarUrlCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_avatar_urls.entries.clear()
+        self.user = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password'
+        )
+        self.avatar = Avatar.objects.create(user = self.user, avatar = 'media/doctor.png')
+        storage = Avatar._meta.get_field('avatar').storage
+        patcher = mock.patch.object(storage, 'url', side_effect = lambda name: f'https://cdn/{name}')
+        self.storage_url = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_url_is_resolved_once(self):
+        for _ in range(3):
+            self.assertEqual(
+                get_avatar_url(self.user.id, self.avatar.avatar),
+                'https://cdn/media/doctor.png'
+            )
+        local_avatar_urls.entries.clear()
+        get_avatar_url(self.user.id, self.avatar.avatar)
+        self.assertEqual(self.storage_url.call_count, 1)
+
+    def test_invalidate_drops_both_levels(self):
+        get_avatar_url(self.user.id, self.avatar.avatar)
+        invalidate_avatar_url(self.user.id, self.avatar.avatar.name)
+        get_avatar_url(self.user.id, self.avatar.avatar)
+        self.assertEqual(self.storage_url.call_count, 2)
+
+    def test_serializer_uses_cached_url(self):
+        data = AvatarSerializer(self.avatar).data
+        AvatarSerializer(self.avatar).data
+        self.assertEqual(data['avatar'], 'https://cdn/media/doctor.png')
+        self.assertEqual(self.storage_url.call_count, 1)
+
+@override_settings(STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.InMemoryStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+})
+class AvatarThumbnailTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password'
+        )
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'teal').save(buffer, format = 'PNG')
+        self.avatar = Avatar(user = self.user)
+        self.avatar.avatar.save('doctor.png', ContentFile(buffer.getvalue()))
+
+    def test_thumbnails_are_written_next_to_the_original(self):
+        generate_avatar_thumbnails(self.user.id)
+        self.avatar.refresh_from_db()
+        for field, size in (('avatar_small', 64), ('avatar_medium', 256)):
+            thumbnail = getattr(self.avatar, field)
+            self.assertTrue(thumbnail.name.startswith(self.avatar.avatar.name.rsplit('.', 1)[0]))
+            with thumbnail.open('rb') as file:
+                self.assertEqual(max(Image.open(file).size), size)
+
+    def test_new_upload_clears_and_requeues_thumbnails(self):
+        generate_avatar_thumbnails(self.user.id)
+        self.avatar.refresh_from_db()
+        buffer = BytesIO()
+        Image.new('RGB', (100, 100), 'navy').save(buffer, format = 'PNG')
+        upload = SimpleUploadedFile('new.png', buffer.getvalue(), content_type = 'image/png')
+        serializer = AvatarSerializer(self.avatar, data = {'avatar': upload}, context = {'user_id': self.user.id})
+        serializer.is_valid(raise_exception = True)
+        old_names = [self.avatar.avatar_small.name, self.avatar.avatar_medium.name]
+        with self.captureOnCommitCallbacks() as callbacks:
+            serializer.save()
+        self.avatar.refresh_from_db()
+        self.assertFalse(self.avatar.avatar_small)
+        self.assertIsNotNone(self.avatar.thumbnails_due_at)
+        #the old thumbnail files and the doctor directory invalidation
+        self.assertEqual(len(callbacks), 2)
+        for callback in callbacks:
+            callback()
+        for name in old_names:
+            self.assertFalse(default_storage.exists(name))
+
+    def test_thumbnails_of_a_replaced_avatar_are_deleted(self):
+        def replace_avatar():
+            #the avatar is replaced while its thumbnails are rendered
+            Avatar.objects.filter(user = self.user).update(avatar = 'media/new.png')
+            return get_thumbnail_format()
+        with mock.patch('user_service.thumbnails.get_thumbnail_format', side_effect = replace_avatar):
+            generate_avatar_thumbnails(self.user.id)
+        stem = self.avatar.avatar.name.split('/')[-1].rsplit('.', 1)[0]
+        self.assertEqual([name for name in default_storage.listdir('media')[1] if name.startswith(f'{stem}_')], [])
+
+    def test_worker_generates_due_thumbnails(self):
+        Avatar.objects.filter(user = self.user).update(thumbnails_due_at = timezone.now())
+        call_command('generate_avatar_thumbnails', stdout = StringIO())
+        self.avatar.refresh_from_db()
+        self.assertTrue(self.avatar.avatar_small)
+        self.assertTrue(self.avatar.avatar_medium)
+        self.assertIsNone(self.avatar.thumbnails_due_at)
+        self.assertEqual(generate_due_thumbnails(), (0, 0, 0))
+
+    def test_failures_are_logged_and_retried(self):
+        Avatar.objects.filter(user = self.user).update(thumbnails_due_at = timezone.now())
+        with mock.patch('user_service.thumbnails.render_thumbnail', side_effect = OSError('disk full')):
+            with self.assertLogs('user_service.thumbnails', 'ERROR') as logs:
+                self.assertEqual(generate_due_thumbnails(), (1, 0, 1))
+            self.assertIn('disk full', logs.output[0])
+            self.avatar.refresh_from_db()
+            self.assertEqual(self.avatar.thumbnail_attempts, 1)
+            self.assertGreater(self.avatar.thumbnails_due_at, timezone.now())
+            for _ in range(THUMBNAIL_MAX_ATTEMPTS - 1):
+                Avatar.objects.filter(user = self.user).update(thumbnails_due_at = timezone.now())
+                with self.assertLogs('user_service.thumbnails', 'ERROR'):
+                    generate_due_thumbnails()
+        self.avatar.refresh_from_db()
+        self.assertEqual(self.avatar.thumbnail_attempts, THUMBNAIL_MAX_ATTEMPTS)
+        self.assertIsNone(self.avatar.thumbnails_due_at)
+
+class LocalS3Storage(InMemoryStorage):
+    '''
+        Stand-in for the S3 bucket in tests.
+        Objects stay in memory, names are never overwritten like with
+        AWS_S3_FILE_OVERWRITE = False and the part sizes of every upload
+        are recorded.
+    '''
+    part_size = 64 * 1024
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('base_url', 'https://bucket.s3.amazonaws.com/')
+        super().__init__(**kwargs)
+        self.parts = {}
+
+    def _save(self, name, content):
+        self.parts[name] = [len(chunk) for chunk in content.chunks(self.part_size)]
+        content.seek(0)
+        return super()._save(name, content)
+
+@override_settings(STORAGES = {
+    "default": {"BACKEND": "user_service.tests.LocalS3Storage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+})
+class AvatarUploadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password'
+        )
+        self.client = APIClient()
+        self.url = f'/users/{self.user.id}/avatars/'
+
+    def make_png(self, size):
+        buffer = BytesIO()
+        Image.effect_noise(size, 64).convert('RGB').save(buffer, format = 'PNG')
+        return SimpleUploadedFile('avatar.png', buffer.getvalue(), content_type = 'image/png')
+
+    def test_accepted_upload_is_stored_in_parts(self):
+        upload = self.make_png((300, 300))
+        response = self.client.post(self.url, {'avatar': upload}, format = 'multipart')
+        self.assertEqual(response.status_code, 201)
+        name = Avatar.objects.get(user = self.user).avatar.name
+        parts = default_storage.parts[name]
+        self.assertGreater(len(parts), 1)
+        self.assertLessEqual(max(parts), LocalS3Storage.part_size)
+
+    def test_decompression_bomb_is_rejected(self):
+        #a tiny png whose header declares 100000x100000 pixels
+        def chunk(kind, data):
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+        header = b'\x89PNG\r\n\x1a\n' \
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', 100000, 100000, 8, 2, 0, 0, 0)) \
+            + chunk(b'IDAT', b'') + chunk(b'IEND', b'')
+        with self.assertRaises(ValidationError):
+            validate_image_dimensions(SimpleUploadedFile('avatar.png', header, content_type = 'image/png'))
+        upload = SimpleUploadedFile('avatar.png', header, content_type = 'image/png')
+        response = self.client.post(self.url, {'avatar': upload}, format = 'multipart')
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_image_is_rejected(self):
+        upload = SimpleUploadedFile('avatar.png', b'#!/bin/sh\necho not an image\n', content_type = 'image/png')
+        response = self.client.post(self.url, {'avatar': upload}, format = 'multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Avatar.objects.exists())
+
+    def test_large_body_is_rejected_from_content_length(self):
+        upload = SimpleUploadedFile('avatar.png', b'\x89PNG\r\n\x1a\n' + b'0' * 1200 * 1024, content_type = 'image/png')
+        response = self.client.post(self.url, {'avatar': upload}, format = 'multipart')
+        self.assertEqual(response.status_code, 413)
+
+    def test_streamed_bytes_are_bounded_without_content_length(self):
+        handler = AvatarUploadHandler()
+        handler.handle_raw_input(None, {}, None, b'boundary')
+        handler.new_file('avatar', 'avatar.png', 'image/png', None)
+        handler.receive_data_chunk(b'\x89PNG\r\n\x1a\n' + b'0' * 1000, 0)
+        with self.assertRaises(FileTooLarge):
+            for _ in range(20):
+                handler.receive_data_chunk(b'0' * 64 * 1024, 0)
+
+class UserAutocompleteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user_index.clear()
+        self.staff = User.objects.create_user(
+            username = 'admin',
+            email = 'admin@example.com',
+            password = 'password',
+            first_name = 'Mary',
+            last_name = 'Jones',
+            is_staff = True
+        )
+        self.doctor = User.objects.create_user(
+            username = 'asmith',
+            email = 'ann@example.com',
+            password = 'password',
+            first_name = 'Ann',
+            last_name = 'Smith'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user = self.staff)
+
+    def autocomplete(self, **params):
+        response = self.client.get('/users/autocomplete/', params)
+        return [user['id'] for user in response.data]
+
+    def test_matches_prefixes_without_queries_once_built(self):
+        self.assertEqual(self.autocomplete(q = 'SMI'), [self.doctor.id])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.autocomplete(q = 'a'), [self.staff.id, self.doctor.id])
+            self.assertEqual(self.autocomplete(q = 'ann smi'), [self.doctor.id])
+            self.assertEqual(self.autocomplete(q = 'a', doctors = 'true'), [self.doctor.id])
+            self.assertEqual(self.autocomplete(q = 'a', limit = 1), [self.staff.id])
+            self.assertEqual(self.autocomplete(q = 'mith'), [])
+
+    def test_index_follows_committed_writes(self):
+        self.autocomplete(q = 'a')
+        with self.captureOnCommitCallbacks(execute = True):
+            self.doctor.last_name = 'Brown'
+            self.doctor.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.autocomplete(q = 'brown'), [self.doctor.id])
+            self.assertEqual(self.autocomplete(q = 'smith'), [])
+        with self.captureOnCommitCallbacks(execute = True):
+            self.doctor.delete()
+        self.assertEqual(self.autocomplete(q = 'ann'), [])
+
+    def test_other_process_writes_trigger_a_rebuild(self):
+        self.autocomplete(q = 'a')
+        User.objects.filter(id = self.doctor.id).update(first_name = 'Zoe')
+        user_index.bump_version()
+        self.assertEqual(self.autocomplete(q = 'zoe'), [self.doctor.id])
+
+class DoctorDirectoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(
+            username = 'admin',
+            email = 'admin@example.com',
+            password = 'password',
+            is_staff = True
+        )
+        self.doctors = [
+            User.objects.create_user(
+                username = f'doctor{index}',
+                email = f'doctor{index}@example.com',
+                password = 'password',
+                first_name = f'Doctor{index}',
+                last_name = 'Smith'
+            ) for index in range(3)
+        ]
+        User.objects.create_user(
+            username = 'inactive',
+            email = 'inactive@example.com',
+            password = 'password',
+            is_active = False
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user = self.staff)
+
+    def test_snapshot_is_cached_and_slim(self):
+        response = self.client.get('/users/doctors/')
+        self.assertEqual([doctor['id'] for doctor in response.data], [doctor.id for doctor in self.doctors])
+        self.assertEqual(set(response.data[0]), {'id', 'first_name', 'last_name', 'avatar'})
+        with self.assertNumQueries(0):
+            self.client.get('/users/doctors/')
+
+    def test_pagination_is_opt_in(self):
+        response = self.client.get('/users/doctors/', {'page_size': 2})
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([doctor['id'] for doctor in response.data['results']], [doctor.id for doctor in self.doctors[:2]])
+
+    def test_conditional_get_until_a_doctor_changes(self):
+        etag = self.client.get('/users/doctors/')['ETag']
+        response = self.client.get('/users/doctors/', HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        with self.captureOnCommitCallbacks(execute = True):
+            self.staff.save(update_fields = ['last_login'])
+        self.assertEqual(self.client.get('/users/doctors/', HTTP_IF_NONE_MATCH = etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute = True):
+            self.doctors[0].is_active = False
+            self.doctors[0].save()
+        response = self.client.get('/users/doctors/', HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertEqual(len(response.data), 2)
+
+    def test_lost_version_is_not_handed_out_again(self):
+        etag = self.client.get('/users/doctors/')['ETag']
+        with self.captureOnCommitCallbacks(execute = True):
+            self.doctors[0].is_active = False
+            self.doctors[0].save()
+        #e.g. a restart of the cache server
+        cache.delete(DIRECTORY_VERSION_KEY)
+        response = self.client.get('/users/doctors/', HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password',
+            first_name = 'Ann',
+            is_staff = True
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION = f'JWT {AccessToken.for_user(self.user)}')
+
+    def test_user_is_resolved_once_per_token(self):
+        self.assertEqual(self.client.get('/users/me/').status_code, 200)
+        #only the avatar is read, the user comes from the cache
+        with self.assertNumQueries(1):
+            response = self.client.get('/users/me/')
+        self.assertEqual(response.data['email'], 'doctor@example.com')
+        self.assertEqual(response.data['first_name'], 'Ann')
+
+    def test_saves_and_deactivation_apply_at_once(self):
+        self.client.get('/users/me/')
+        with self.captureOnCommitCallbacks(execute = True):
+            self.user.first_name = 'Mary'
+            self.user.save()
+        self.assertEqual(self.client.get('/users/me/').data['first_name'], 'Mary')
+        with self.captureOnCommitCallbacks(execute = True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/users/me/').status_code, 401)
+
+    def test_cached_user_saves_only_loaded_fields(self):
+        self.client.get('/users/me/')
+        response = self.client.patch('/users/me/', {'last_name': 'Smith'})
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_name, 'Smith')
+        self.assertTrue(self.user.check_password('password'))
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username = 'doctor',
+            email = 'doctor@example.com',
+            password = 'password',
+            is_active = False
+        )
+
+    def activate(self):
+        self.user.is_active = True
+        self.user.save()
+
+    def test_activation_only_queues_the_welcome_email(self):
+        self.activate()
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.to, ['doctor@example.com'])
+        self.assertIn('Username: doctor', email.body)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_already_activated)
+        #later saves and stale copies of the user do not queue it again
+        self.activate()
+        User.objects.get(pk = self.user.pk).save()
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_password_reset_is_queued(self):
+        self.activate()
+        response = APIClient().post('/auth/users/reset_password/', {'email': 'doctor@example.com'})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.latest('id')
+        self.assertEqual(email.to, ['doctor@example.com'])
+        self.assertIn('/reset/', email.body)
+        self.assertIn('<a href=', email.html_body)
+
+    def test_worker_sends_a_batch_over_one_connection(self):
+        for index in range(3):
+            OutboxEmail.objects.create(subject = 'Subject', body = 'Body', from_email = 'from@example.com', to = [f'user{index}@example.com'])
+        connection = mail.get_connection()
+        with mock.patch.object(connection, 'open', wraps = connection.open) as opened:
+            self.assertEqual(send_outbox_batch(2, connection), (2, 2, 0))
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual([message.to for message in mail.outbox], [['user0@example.com'], ['user1@example.com']])
+        self.assertEqual(send_outbox_batch(2), (1, 1, 0))
+        self.assertEqual(send_outbox_batch(2), (0, 0, 0))
+        self.assertFalse(OutboxEmail.objects.exclude(status = OutboxEmail.STATUS_SENT).exists())
+
+    def test_failed_emails_back_off_and_give_up(self):
+        email = OutboxEmail.objects.create(subject = 'Subject', body = 'Body', from_email = 'from@example.com', to = ['user@example.com'])
+        delays = []
+        for attempt in range(OUTBOX_MAX_ATTEMPTS - 1):
+            OutboxEmail.objects.filter(id = email.id).update(next_attempt_at = datetime.datetime(2000, 1, 1, tzinfo = datetime.timezone.utc))
+            before = datetime.datetime.now(datetime.timezone.utc)
+            self.assertEqual(send_outbox_batch(connection = FailingEmailBackend()), (1, 0, 1))
+            email.refresh_from_db()
+            delays.append(email.next_attempt_at - before)
+        OutboxEmail.objects.filter(id = email.id).update(next_attempt_at = datetime.datetime(2000, 1, 1, tzinfo = datetime.timezone.utc))
+        with self.assertLogs('user_service.outbox', 'ERROR'):
+            send_outbox_batch(connection = FailingEmailBackend())
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.STATUS_FAILED)
+        self.assertEqual(email.attempts, OUTBOX_MAX_ATTEMPTS)
+        self.assertIn('SMTPServerDisconnected', email.last_error)
+        #every retry waits about twice as long as the previous one
+        self.assertGreater(delays[1], delays[0] * 1.5)
+        self.assertGreater(delays[2], delays[1] * 1.5)
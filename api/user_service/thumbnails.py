@@ -0,0 +1,157 @@
+import datetime
+import logging
+import os
+from io import BytesIO
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+from .avatars import invalidate_avatar_url
+from .directory import invalidate_doctor_directory
+from .models import Avatar
+
+#longest side in pixels of every generated size
+THUMBNAIL_SIZES = {
+    'small': 64,
+    'medium': 256
+}
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_BATCH_SIZE = 20
+THUMBNAIL_MAX_ATTEMPTS = 5
+#first retry delay, doubled by every further failed attempt
+THUMBNAIL_RETRY_DELAY = datetime.timedelta(minutes=1)
+THUMBNAIL_MAX_RETRY_DELAY = datetime.timedelta(hours=1)
+#claimed avatars are not picked up by another worker for this long
+THUMBNAIL_CLAIM_TIMEOUT = datetime.timedelta(minutes=5)
+
+def get_thumbnail_format():
+    if features.check('webp'):
+        return 'WEBP', 'webp'
+    return 'JPEG', 'jpg'
+
+def render_thumbnail(image, size, image_format):
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size))
+    if image_format == 'JPEG':
+        thumbnail = thumbnail.convert('RGB')
+    elif thumbnail.mode not in ('RGB', 'RGBA'):
+        thumbnail = thumbnail.convert('RGBA')
+    buffer = BytesIO()
+    thumbnail.save(buffer, format=image_format, quality=85)
+    return ContentFile(buffer.getvalue())
+
+def generate_avatar_thumbnails(user_id):
+    '''
+        Writes the small and medium thumbnails next to the original avatar
+        and stores their names, unless the avatar was replaced meanwhile
+    '''
+    avatar = Avatar.objects.filter(user_id=user_id).first()
+    if avatar is None:
+        return
+    source_name = avatar.avatar.name
+    if not avatar.avatar:
+        #nothing to render, the job is done
+        Avatar.objects.filter(user_id=user_id, avatar=source_name).update(thumbnails_due_at=None)
+        return
+    with avatar.avatar.open('rb') as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+
+    image_format, extension = get_thumbnail_format()
+    stem = os.path.splitext(source_name)[0]
+    names = {
+        f'avatar_{size_name}': avatar.avatar.storage.save(
+            f'{stem}_{size_name}.{extension}',
+            render_thumbnail(image, size, image_format)
+        ) for size_name, size in THUMBNAIL_SIZES.items()
+    }
+    if Avatar.objects.filter(user_id=user_id, avatar=source_name).update(**names, thumbnails_due_at=None, thumbnail_attempts=0):
+        invalidate_doctor_directory()
+    else:
+        #the avatar was replaced meanwhile, the files belong to no row
+        delete_thumbnail_files(avatar.avatar.storage, names.values())
+
+def delete_thumbnail_files(storage, names):
+    for name in names:
+        if name:
+            storage.delete(name)
+
+def clear_avatar_thumbnails(avatar: Avatar):
+    '''
+        Drops the thumbnails of the previous file before a new one is saved,
+        their files are deleted once the new avatar is committed
+    '''
+    storage = avatar.avatar.storage
+    names = []
+    for size_name in THUMBNAIL_SIZES:
+        field = f'avatar_{size_name}'
+        name = getattr(avatar, field).name
+        invalidate_avatar_url(avatar.user_id, name)
+        names.append(name)
+        setattr(avatar, field, None)
+    if any(names):
+        transaction.on_commit(lambda: delete_thumbnail_files(storage, names))
+
+def schedule_avatar_thumbnails(avatar: Avatar):
+    '''
+        Marks the thumbnails of a new file due before the avatar is saved,
+        the generate_avatar_thumbnails worker picks them up once it is committed
+    '''
+    avatar.thumbnails_due_at = timezone.now()
+    avatar.thumbnail_attempts = 0
+
+def get_retry_delay(attempts):
+    return min(THUMBNAIL_RETRY_DELAY * 2 ** (attempts - 1), THUMBNAIL_MAX_RETRY_DELAY)
+
+def claim_avatar_thumbnails(batch_size, now):
+    '''
+        Moves the due time of a batch of due avatars past the claim
+        timeout, so concurrent workers skip them while they are rendered
+        and a crashed worker's batch is retried once the claim expires
+    '''
+    with transaction.atomic():
+        user_ids = list(Avatar.objects.filter(
+                        thumbnails_due_at__lte=now
+                    ).order_by(
+                        'thumbnails_due_at'
+                    ).select_for_update(
+                        skip_locked=True
+                    ).values_list('user_id', flat=True)[:batch_size])
+        Avatar.objects.filter(user_id__in=user_ids).update(thumbnails_due_at=now + THUMBNAIL_CLAIM_TIMEOUT)
+    return user_ids
+
+def record_thumbnail_failure(user_id, now):
+    #a new upload resets the due time and the attempts, its job is left alone
+    claimed = Avatar.objects.filter(user_id=user_id, thumbnails_due_at=now + THUMBNAIL_CLAIM_TIMEOUT)
+    attempts = claimed.values_list('thumbnail_attempts', flat=True).first()
+    if attempts is None:
+        return
+    attempts += 1
+    if attempts >= THUMBNAIL_MAX_ATTEMPTS:
+        logger.error('Giving up on the thumbnails of the avatar of user %s after %s attempts', user_id, attempts)
+        claimed.update(thumbnail_attempts=attempts, thumbnails_due_at=None)
+    else:
+        claimed.update(thumbnail_attempts=attempts, thumbnails_due_at=now + get_retry_delay(attempts))
+
+def generate_due_thumbnails(batch_size=THUMBNAIL_BATCH_SIZE):
+    '''
+        Generates the thumbnails of a batch of due avatars.
+        Failed avatars are retried with exponential backoff and given up
+        after THUMBNAIL_MAX_ATTEMPTS, every failure is logged.
+        Returns the number of claimed avatars, generated avatars and failed attempts.
+    '''
+    now = timezone.now()
+    user_ids = claim_avatar_thumbnails(batch_size, now)
+    generated = failed = 0
+    for user_id in user_ids:
+        try:
+            generate_avatar_thumbnails(user_id)
+        except Exception:
+            failed += 1
+            logger.exception('Could not generate the thumbnails of the avatar of user %s', user_id)
+            record_thumbnail_failure(user_id, now)
+        else:
+            generated += 1
+    return len(user_ids), generated, failed
@@ -0,0 +1,61 @@
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.status import HTTP_413_REQUEST_ENTITY_TOO_LARGE
+from .validators import MAX_AVATAR_SIZE_IN_KB
+
+#leading bytes of the image formats accepted as avatars
+IMAGE_SIGNATURES = (
+    b'\x89PNG\r\n\x1a\n',
+    b'\xff\xd8\xff',
+    b'GIF87a',
+    b'GIF89a',
+)
+
+class FileTooLarge(APIException):
+    status_code = HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = f'File cannot be bigger than {MAX_AVATAR_SIZE_IN_KB} KB.'
+    default_code = 'file_too_large'
+
+def is_image_signature(header):
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return True
+    return header.startswith(IMAGE_SIGNATURES)
+
+class AvatarUploadHandler(FileUploadHandler):
+    '''
+        First upload handler of the avatar endpoints.
+        Rejects a body from its Content-Length before anything is read,
+        stops reading once the streamed file passes the size limit and
+        sniffs the leading bytes so non images are dropped after the first chunk.
+        Chunks are passed on to the next handler, which spools them to a
+        temporary file that the storage backend uploads in chunks.
+    '''
+    max_size = MAX_AVATAR_SIZE_IN_KB * 1024
+    #room for the multipart boundaries and the other form fields
+    max_overhead = 64 * 1024
+    header_size = 12
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length and content_length > self.max_size + self.max_overhead:
+            raise FileTooLarge()
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.header = b''
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            raise FileTooLarge()
+        if len(self.header) < self.header_size:
+            self.header += raw_data[:self.header_size - len(self.header)]
+            if len(self.header) >= self.header_size and not is_image_signature(self.header):
+                raise ValidationError({"avatar": ["Upload a valid image."]})
+        return raw_data
+
+    def file_complete(self, file_size):
+        if file_size and not is_image_signature(self.header):
+            raise ValidationError({"avatar": ["Upload a valid image."]})
+        return None
@@ -1,9 +1,33 @@
 from django.core.exceptions import ValidationError
+from PIL import Image
+
+MAX_AVATAR_SIZE_IN_KB = 1000
+MAX_AVATAR_DIMENSION = 4096
 
 def validate_file_size(file):
-    max_file_size_in_kb = 1000
+    max_file_size_in_kb = MAX_AVATAR_SIZE_IN_KB
     
     if file.size > max_file_size_in_kb * 1024:
         raise ValidationError(
             message = f'File cannot be bigger than {max_file_size_in_kb} KB.'
-        )
\ No newline at end of file
+        )
+
+def validate_image_dimensions(file):
+    #only the header is parsed, the bitmap is never decoded
+    too_large = ValidationError(
+        message = f'Image cannot be larger than {MAX_AVATAR_DIMENSION}x{MAX_AVATAR_DIMENSION} pixels.'
+    )
+    try:
+        file.seek(0)
+        width, height = Image.open(file).size
+    except Image.DecompressionBombError:
+        #the header declares far more pixels than Pillow agrees to open
+        raise too_large
+    except (OSError, ValueError):
+        raise ValidationError(
+            message = 'Upload a valid image.'
+        )
+    finally:
+        file.seek(0)
+    if max(width, height) > MAX_AVATAR_DIMENSION:
+        raise too_large
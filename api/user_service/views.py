@@ -1,16 +1,22 @@
 from djoser.views import UserViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 from django.contrib.auth import get_user_model
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
 from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.status import HTTP_204_NO_CONTENT
 from rest_framework.viewsets import ModelViewSet
+from .autocomplete import user_index
+from .conditional import is_not_modified, not_modified_response, set_etag
+from .directory import get_doctor_directory
 from .filters import CustomUserFilter
 from .models import Avatar
-from .pagination import CustomPagination
+from .pagination import CustomPagination, DirectoryPagination
 from .serializers import CustomUserSerializer, AvatarSerializer
+from .uploads import AvatarUploadHandler
 
 User = get_user_model()
 
@@ -18,6 +24,14 @@ class AvatarsViewSet(ModelViewSet):
     serializer_class = AvatarSerializer
     permission_classes = []
     
+    def initialize_request(self, request, *args, **kwargs):
+        # Bound and sniff uploads while they stream in and spool accepted files to disk
+        request.upload_handlers = [
+            AvatarUploadHandler(request),
+            TemporaryFileUploadHandler(request)
+        ]
+        return super().initialize_request(request, *args, **kwargs)
+    
     def get_queryset(self):
         return Avatar.objects.filter(user = self.kwargs['user_id'])
     
@@ -59,8 +73,45 @@ class CustomUserViewSet(UserViewSet):
         self.perform_destroy(instance)
         return Response(status=HTTP_204_NO_CONTENT)
 
-    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsAdminUser])
+    '''
+        Slim directory of the active doctors served from a versioned
+        cached snapshot, the version doubles as the ETag for conditional GETs
+    '''
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsAdminUser], pagination_class=DirectoryPagination)
     def doctors(self, request, *args, **kwargs):
-        active_doctors = self.queryset.filter(is_active=True, is_staff=False)
-        serializer = CustomUserSerializer(active_doctors, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        version, directory = get_doctor_directory()
+        etag = f'"doctors-{version}"'
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+        page = self.paginate_queryset(directory)
+        if page is not None:
+            response = self.get_paginated_response(page)
+        else:
+            response = Response(directory)
+        return set_etag(response, etag)
+    
+    '''
+        Type ahead search over username, email and names served from the
+        in-process prefix index without a database query.
+        doctors=true limits the matches to active doctors like doctors/
+    '''
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsAdminUser])
+    def autocomplete(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            raise ValidationError({"limit": ["A valid integer is required."]})
+        users = user_index.search(
+            request.query_params.get('q', ''),
+            limit,
+            doctors_only = request.query_params.get('doctors') == 'true'
+        )
+        return Response([
+            {
+                'id': user['id'],
+                'username': user['username'],
+                'email': user['email'],
+                'first_name': user['first_name'],
+                'last_name': user['last_name']
+            } for user in users
+        ])